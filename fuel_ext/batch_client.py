@@ -0,0 +1,90 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import functools
+import logging
+from multiprocessing.pool import ThreadPool
+
+
+LOG = logging.getLogger(__name__)
+
+
+class BatchNailgunClient(object):
+    """Runs NailgunClient calls in batches on a pool of threads.
+
+    The calls are the usual blocking ones, made by worker threads: every
+    public NailgunClient method (clusters, nodes, disks, interfaces,
+    tasks, OSTF, ...) is available under the same name, but returns an
+    AsyncResult right away instead of the parsed response:
+
+        batch = BatchNailgunClient(client, workers=10)
+        results = [batch.get_node_disks(node_id) for node_id in node_ids]
+        disks = batch.gather(results)
+
+    At most `workers` requests are in flight, the others wait in the
+    queue of the pool. A ThreadPool can be given as `pool` to share its
+    threads, it is then left open by close(). The workers share the
+    keep-alive connections, the keystone token and the caches of the
+    wrapped client; the connection pool of the client is left as it is,
+    workers beyond its maxsize open connections which are not kept. A
+    `callback` keyword argument is called with the result on success.
+    """
+
+    def __init__(self, client, workers=10, pool=None):
+        self.client = client
+        self.workers = workers
+        self._own_pool = pool is None
+        self._workers = ThreadPool(workers) if pool is None else pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if name.startswith('_') or not callable(method):
+            return method
+
+        @functools.wraps(method)
+        def submit(*args, **kwargs):
+            return self.submit(method, *args, **kwargs)
+        return submit
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule `func(*args, **kwargs)` and return its AsyncResult."""
+        callback = kwargs.pop('callback', None)
+        return self._workers.apply_async(func, args, kwargs, callback)
+
+    def authenticate(self, callback=None):
+        return self.submit(self.client.client.authenticate,
+                           callback=callback)
+
+    @staticmethod
+    def gather(results, timeout=None):
+        """Wait for all results and return their values in order.
+
+        The first failed call re-raises its exception here.
+        """
+        return [result.get(timeout) for result in results]
+
+    def close(self):
+        """Stop accepting calls and wait for the queued ones.
+
+        A pool given to the constructor is left to its owner.
+        """
+        if self._own_pool:
+            self._workers.close()
+            self._workers.join()
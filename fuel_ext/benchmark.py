@@ -0,0 +1,280 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""End-to-end benchmarks of fuel-env and NailgunClient.
+
+Every scenario runs in its own process against a FakeNailgun with the
+requested number of nodes, itself in another process, and reports the
+wall time, the number of API requests and the peak RSS of the scenario
+process (the client side only). Results
+are written to a JSON file which a later run can be compared against:
+
+    fuel-bench --output before.json
+    ... change things ...
+    fuel-bench --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import platform
+import Queue
+import resource
+import sys
+import time
+
+from fuel_ext import env
+from fuel_ext.fake_nailgun import FakeNailgun
+from fuel_ext.nailgun_client import NailgunClient
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_NODES = (10, 100, 1000, 5000)
+
+
+def make_settings(nodes, env_name='bench'):
+    """Settings deploying every node: 3 controllers, the rest computes."""
+    settings_nodes = []
+    for node in nodes:
+        controller = len(settings_nodes) < 3
+        settings_nodes.append({
+            'mac': node['mac'],
+            'name': '{0}-{1}'.format(
+                'contr' if controller else 'comp', node['id']),
+            'roles': ['controller'] if controller else ['compute'],
+            'interfaces': {'eth0': ['storage'],
+                           'eth1': ['private', 'management', 'public']},
+            'disks': {'sda': {'os': 50000, 'image' if controller else 'vm':
+                              100000}},
+        })
+    return env.parse_settings({
+        'env_name': env_name,
+        'master_ip': '127.0.0.1',
+        'nodes': settings_nodes,
+        'networks': {
+            'public_network': {'cidr': '172.16.0.0/24',
+                               'gateway': '172.16.0.1',
+                               'ip_ranges': [['172.16.0.2', '172.16.0.126']]},
+            'floating_ranges': [['172.16.0.130', '172.16.0.254']]},
+    })
+
+
+def _fuel_env(client, fake, options):
+    settings = make_settings(client.get_nodes())
+    env.build_env(client, settings, options.concurrency)
+
+
+def _per_node(method):
+    def scenario(client, fake, options):
+        for node in client.get_nodes():
+            getattr(client, method)(node['id'])
+    return scenario
+
+
+SCENARIOS = {
+    'fuel-env': _fuel_env,
+    'fuel-env-rerun': _fuel_env,
+    'get_nodes': lambda client, fake, options: client.get_nodes(),
+    'iter_nodes': lambda client, fake, options: sum(
+        1 for _ in client.iter_nodes()),
+    'get_node_disks': _per_node('get_node_disks'),
+    'get_node_interfaces': _per_node('get_node_interfaces'),
+    'get_tasks': lambda client, fake, options: client.get_tasks(),
+}
+
+# Run before a scenario, neither timed nor counted: fuel-env-rerun times
+# building an environment which is up to date.
+SETUPS = {
+    'fuel-env-rerun': _fuel_env,
+}
+
+
+class _FakeProcess(object):
+    """FakeNailgun served by a process of its own, driven over a pipe."""
+
+    def __init__(self, nodes, latency):
+        self._conn, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=self._serve, args=(child, self._conn, nodes, latency))
+        self._process.daemon = True
+        self._process.start()
+        child.close()
+        self.port = self._conn.recv()
+
+    @staticmethod
+    def _serve(conn, parent_conn, nodes, latency):
+        # Only the scenario process keeps its end open, the pipe ends with
+        # it.
+        parent_conn.close()
+        fake = FakeNailgun(nodes=nodes, latency={'*': latency}).start()
+        conn.send(fake.port)
+        while True:
+            try:
+                command = conn.recv()
+            except EOFError:
+                # The scenario process died without stopping it.
+                command = None
+            if command == 'requests':
+                conn.send(sum(fake.stats.values()))
+            elif command == 'clear':
+                fake.stats.clear()
+                conn.send(None)
+            else:
+                fake.stop()
+                if command == 'stop':
+                    conn.send(None)
+                return
+
+    def _call(self, command):
+        self._conn.send(command)
+        return self._conn.recv()
+
+    def requests(self):
+        return self._call('requests')
+
+    def clear(self):
+        self._call('clear')
+
+    def stop(self):
+        self._call('stop')
+        self._process.join()
+
+
+def _run(scenario, nodes, options, queue):
+    fake = _FakeProcess(nodes, options.latency)
+    try:
+        client = NailgunClient('127.0.0.1', 'admin', 'admin', 'admin',
+                               port=fake.port, keystone_port=fake.port,
+                               response_cache=False, token_cache=False)
+        client.client.authenticate()
+        if scenario in SETUPS:
+            SETUPS[scenario](client, fake, options)
+        fake.clear()
+        started = time.time()
+        SCENARIOS[scenario](client, fake, options)
+        wall_time = time.time() - started
+        queue.put({
+            'scenario': scenario,
+            'nodes': nodes,
+            'wall_time': round(wall_time, 4),
+            'requests': fake.requests(),
+            'peak_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+        })
+    except Exception as e:
+        LOG.exception('Scenario %s with %s nodes failed', scenario, nodes)
+        queue.put({'scenario': scenario, 'nodes': nodes, 'error': str(e)})
+    finally:
+        fake.stop()
+
+
+def _result(process, queue, scenario, nodes):
+    # A process killed (by the OOM killer, a segfault) never puts its
+    # result, it is reported as an error instead of waited for.
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Queue.Empty:
+            if process.exitcode is None:
+                continue
+        try:
+            # It may have put its result just before exiting.
+            return queue.get(timeout=1)
+        except Queue.Empty:
+            return {'scenario': scenario, 'nodes': nodes,
+                    'error': 'process exited with code {0}'.format(
+                        process.exitcode)}
+
+
+def run(scenarios, sizes, options):
+    results = []
+    for nodes in sizes:
+        for scenario in scenarios:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_run, args=(scenario, nodes, options, queue))
+            process.start()
+            result = _result(process, queue, scenario, nodes)
+            process.join()
+            LOG.info('%s', result)
+            results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print results next to a baseline, return the regressed ones."""
+    previous = dict(((r['scenario'], r['nodes']), r)
+                    for r in baseline['results'] if 'error' not in r)
+    regressions = []
+    line = '{0:<22} {1:>6} {2:>10} {3:>10} {4:>8} {5:>9} {6:>9}\n'
+    sys.stdout.write(line.format('SCENARIO', 'NODES', 'BEFORE', 'AFTER',
+                                 'RATIO', 'REQUESTS', 'RSS_MB'))
+    for result in results:
+        old = previous.get((result['scenario'], result['nodes']))
+        if old is None or 'error' in result:
+            continue
+        ratio = result['wall_time'] / max(old['wall_time'], 1e-6)
+        if ratio > 1 + threshold:
+            regressions.append(result)
+        sys.stdout.write(line.format(
+            result['scenario'], result['nodes'],
+            '%.3fs' % old['wall_time'], '%.3fs' % result['wall_time'],
+            '%.2f' % ratio,
+            '%s/%s' % (old['requests'], result['requests']),
+            '%d' % (result['peak_rss_kb'] // 1024)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='fuel-bench')
+    parser.add_argument('--nodes', type=int, nargs='+',
+                        default=list(DEFAULT_NODES))
+    parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS),
+                        default=sorted(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.001,
+                        help='seconds the fake master adds to each request')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', default='fuel-bench.json')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results file of a previous run')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = run(args.scenario, args.nodes, args)
+    with open(args.output, 'w') as f:
+        json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(),
+                   'options': {'latency': args.latency,
+                               'concurrency': args.concurrency},
+                   'results': results}, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            sys.exit('%s scenario(s) regressed by more than %d%%' % (
+                len(regressions), args.threshold * 100))
+    else:
+        for result in results:
+            sys.stdout.write('{0}\n'.format(json.dumps(result,
+                                                       sort_keys=True)))
+
+
+if __name__ == '__main__':
+    main()
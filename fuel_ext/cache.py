@@ -0,0 +1,120 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import copy
+import functools
+import threading
+import time
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds.
+
+    Values are deep-copied on the way in and out, callers are free to
+    modify what they get (and env.main does).
+    """
+
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = collections.Counter()
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (True, value) on a hit and (False, None) on a miss."""
+        with self._lock:
+            try:
+                stored_at, value = self._data.pop(key)
+            except KeyError:
+                self.stats['misses'] += 1
+                return False, None
+            if time.time() - stored_at > self.ttl:
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return False, None
+            self._data[key] = (stored_at, value)
+            self.stats['hits'] += 1
+        return True, copy.deepcopy(value)
+
+    def set(self, key, value):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time(), value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.stats['invalidated'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def cache_key(kind, *args):
+    # IDs come both as ints and strings, 1 and '1' are the same entry.
+    return (kind,) + tuple(str(arg) for arg in args)
+
+
+def cached(kind):
+    """Cache results of a client method in its `cache` attribute.
+
+    The cache key is the `kind` plus the positional arguments of the call,
+    so `cached('cluster')` on `get_cluster(cluster_id)` stores the result
+    under cache_key('cluster', cluster_id).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(self, *args):
+            if self.cache is None:
+                return func(self, *args)
+            key = cache_key(kind, *args)
+            hit, value = self.cache.get(key)
+            if hit:
+                return value
+            value = func(self, *args)
+            self.cache.set(key, value)
+            return value
+        return wrapped
+    return decorator
+
+
+def invalidates(*kinds):
+    """Drop cached entries of `kinds` once a write method has run.
+
+    The first positional argument of the write is the object ID; both the
+    entry of that object and the list entry of its kind (cached without
+    arguments) are dropped, whether the write succeeded or not.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(self, object_id, *args, **kwargs):
+            try:
+                return func(self, object_id, *args, **kwargs)
+            finally:
+                if self.cache is not None:
+                    keys = []
+                    for kind in kinds:
+                        keys.append(cache_key(kind, object_id))
+                        keys.append(cache_key(kind))
+                    self.cache.invalidate(*keys)
+        return wrapped
+    return decorator
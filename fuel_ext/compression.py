@@ -0,0 +1,161 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import logging
+import threading
+import urllib2
+import zlib
+
+
+LOG = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class CompressionHandler(urllib2.BaseHandler):
+    """Negotiate gzip/deflate responses and decode them transparently.
+
+    Request bodies of at least `min_size` bytes are gzipped when
+    `compress_requests` is set. A server answering 415 Unsupported Media
+    Type to a gzipped body gets it again uncompressed, and request
+    compression is turned off for the rest of the session.
+
+    `stats` holds the size of compressed responses on the wire and once
+    decoded, and the same for compressed requests.
+    """
+
+    # Run before HTTPHandler computes Content-Length of the request body.
+    handler_order = 400
+
+    def __init__(self, compress_requests=False, min_size=1024):
+        self.compress_requests = compress_requests
+        self.min_size = min_size
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def count(self, **sizes):
+        with self._lock:
+            self.stats.update(sizes)
+
+    def http_request(self, req):
+        if not req.has_header('Accept-encoding'):
+            req.add_unredirected_header('Accept-Encoding', 'gzip, deflate')
+        data = req.get_data()
+        if (self.compress_requests and data is not None and
+                len(data) >= self.min_size and
+                not req.has_header('Content-encoding')):
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            compressed = compressor.compress(data) + compressor.flush()
+            self.count(request_bytes=len(data),
+                       request_wire_bytes=len(compressed))
+            req.uncompressed_data = data
+            req.add_data(compressed)
+            req.add_unredirected_header('Content-Encoding', 'gzip')
+        return req
+
+    def http_response(self, req, response):
+        encoding = response.info().getheader('Content-Encoding', '')
+        encoding = encoding.strip().lower()
+        if encoding not in ('gzip', 'x-gzip', 'deflate'):
+            return response
+        fp = DecodingReader(response, encoding, self)
+        decoded = urllib2.addinfourl(fp, response.info(), response.geturl(),
+                                     response.code)
+        decoded.msg = response.msg
+        return decoded
+
+    def http_error_415(self, req, fp, code, msg, headers):
+        data = getattr(req, 'uncompressed_data', None)
+        if data is None:
+            return None
+        LOG.warning('%s does not accept compressed requests, sending '
+                    'them uncompressed', req.get_host())
+        fp.read()
+        fp.close()
+        self.compress_requests = False
+        req.uncompressed_data = None
+        req.add_data(data)
+        for header in ('Content-encoding', 'Content-length'):
+            req.unredirected_hdrs.pop(header, None)
+        return self.parent.open(req, timeout=req.timeout)
+
+
+class DecodingReader(object):
+    """File-like object decompressing a gzip or deflate response body."""
+
+    def __init__(self, fp, encoding, handler):
+        self.fp = fp
+        self.handler = handler
+        if encoding == 'deflate':
+            self._decoder = zlib.decompressobj()
+        else:
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._raw_deflate = encoding == 'deflate'
+        self._buf = ''
+        self._eof = False
+
+    def _decompress(self, data):
+        try:
+            return self._decoder.decompress(data)
+        except zlib.error:
+            if not self._raw_deflate:
+                raise
+            # Some servers send a bare deflate stream without zlib header.
+            self._raw_deflate = False
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decoder.decompress(data)
+
+    def _fill(self):
+        while not self._eof:
+            data = self.fp.read(CHUNK_SIZE)
+            if data:
+                decoded = self._decompress(data)
+                # Only the zlib header was seen so far.
+                self._raw_deflate = False
+            else:
+                self._eof = True
+                decoded = self._decoder.flush()
+            self.handler.count(response_wire_bytes=len(data),
+                               response_bytes=len(decoded))
+            if decoded:
+                self._buf += decoded
+                return
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            chunks = [self._buf]
+            self._buf = ''
+            while not self._eof:
+                self._fill()
+                chunks.append(self._buf)
+                self._buf = ''
+            return ''.join(chunks)
+        while len(self._buf) < amt and not self._eof:
+            self._fill()
+        data, self._buf = self._buf[:amt], self._buf[amt:]
+        return data
+
+    def readline(self, limit=-1):
+        while '\n' not in self._buf and not self._eof:
+            self._fill()
+        end = self._buf.find('\n') + 1 or len(self._buf)
+        if limit >= 0:
+            end = min(end, limit)
+        line, self._buf = self._buf[:end], self._buf[end:]
+        return line
+
+    def close(self):
+        self.fp.close()
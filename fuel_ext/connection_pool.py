@@ -0,0 +1,202 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import httplib
+import logging
+import select
+import socket
+import threading
+import time
+import urllib2
+
+
+LOG = logging.getLogger(__name__)
+
+# Requests sent again when a reused connection turns out to be closed
+# after they were sent; the others only if they could not be sent whole.
+RETRY_METHODS = ('GET', 'HEAD')
+
+
+def _dropped(conn):
+    # An idle connection with something to read was closed by the server
+    # (or is out of sync), it would fail the next request.
+    if conn.sock is None:
+        return False
+    poller = select.poll()
+    poller.register(conn.sock, select.POLLIN)
+    try:
+        return bool(poller.poll(0))
+    except (select.error, socket.error):
+        return True
+
+
+class ConnectionPool(object):
+    """Pool of persistent HTTP/1.1 connections, grouped by host.
+
+    A connection goes back to the pool only after its response has been
+    read to the end, so it is never reused in the middle of a response.
+    Connections idle for longer than `idle_timeout` seconds are dropped.
+    """
+
+    def __init__(self, maxsize=10, idle_timeout=30, timeout=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stats = collections.Counter()
+        self._idle = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+    def _new_connection(self, host):
+        self.stats['created'] += 1
+        if self.timeout is None:
+            return httplib.HTTPConnection(host)
+        return httplib.HTTPConnection(host, timeout=self.timeout)
+
+    def get(self, host):
+        """Return a (connection, reused) pair for the given host."""
+        now = time.time()
+        with self._lock:
+            idle = self._idle[host]
+            while idle:
+                conn, released_at = idle.pop()
+                if now - released_at > self.idle_timeout:
+                    self.stats['expired'] += 1
+                elif _dropped(conn):
+                    self.stats['dropped'] += 1
+                else:
+                    self.stats['reused'] += 1
+                    return conn, True
+                conn.close()
+            return self._new_connection(host), False
+
+    def put(self, host, conn):
+        with self._lock:
+            idle = self._idle[host]
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        self.discard(conn)
+
+    def discard(self, conn):
+        with self._lock:
+            self.stats['discarded'] += 1
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, collections.defaultdict(
+                collections.deque)
+        for connections in idle.values():
+            for conn, _ in connections:
+                conn.close()
+
+    def urlopen(self, req):
+        """Send an urllib2 request over a pooled connection.
+
+        Idle connections the server closed are left out before anything
+        is written to them. A request that still fails on a reused
+        connection is retried once on a fresh one if it could not be sent
+        whole, as the server can not have acted on it, or if it is a GET
+        or HEAD; otherwise the server may have done what was asked and
+        URLError is raised.
+        """
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict(
+            (name.title(), val) for name, val in headers.items())
+
+        method = req.get_method()
+        while True:
+            conn, reused = self.get(host)
+            sent = False
+            try:
+                conn.request(method, req.get_selector(), req.data, headers)
+                sent = True
+                response = conn.getresponse(buffering=True)
+            except (socket.error, httplib.HTTPException) as e:
+                self.discard(conn)
+                if reused and (not sent or method in RETRY_METHODS):
+                    LOG.debug('Stale connection to %s, retrying: %s',
+                              host, e)
+                    with self._lock:
+                        self.stats['retried'] += 1
+                    continue
+                raise urllib2.URLError(e)
+            break
+
+        body = PooledResponse(self, host, conn, response)
+        if response.length == 0:
+            # Nothing to read (e.g. 204 or 304), recycle the connection now.
+            body.read()
+        fp = socket._fileobject(body, close=True)
+        resp = urllib2.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+
+class PooledResponse(object):
+    """Response body that hands its connection back once fully read."""
+
+    def __init__(self, pool, host, conn, response):
+        self._pool = pool
+        self._host = host
+        self._conn = conn
+        self._response = response
+
+    def read(self, amt=None):
+        if self._conn is None:
+            return ''
+        try:
+            data = self._response.read(amt)
+        except (socket.error, httplib.HTTPException):
+            self._release(reuse=False)
+            raise
+        if self._response.isclosed():
+            self._release(reuse=not self._response.will_close)
+        return data
+
+    recv = read
+
+    def close(self):
+        # Unread data left on the wire makes the connection unusable.
+        self._release(reuse=False)
+
+    def _release(self, reuse):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if reuse:
+            self._pool.put(self._host, conn)
+        else:
+            self._response.close()
+            self._pool.discard(conn)
+
+
+class KeepAliveHandler(urllib2.HTTPHandler):
+    """urllib2 handler sending plain HTTP requests through a pool."""
+
+    def __init__(self, pool=None):
+        urllib2.HTTPHandler.__init__(self)
+        self.pool = pool if pool is not None else ConnectionPool()
+
+    def http_open(self, req):
+        return self.pool.urlopen(req)
@@ -0,0 +1,238 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long-running fuel-env serving jobs over a local Unix socket.
+
+The daemon keeps its Nailgun clients authenticated, with their connection
+pools and caches, from one job to the next, so a job submitted with
+fuel-env-submit starts without paying for imports and authentication:
+
+    fuel-env-daemon &
+    fuel-env-submit --concurrency 8 settings.json
+
+Messages are JSON objects, one per line. The submitter sends the job,
+{"settings": [paths], "concurrency": N, "parallel_envs": N, "plan": bool,
+"resume": bool, "timings": bool}, the daemon streams {"log": line}
+messages while the job runs and ends with {"output": text, "error":
+message or null}. Jobs run concurrently, except those building the same
+environment which wait for each other.
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import SocketServer
+import StringIO
+import sys
+import threading
+import time
+
+from fuel_ext import env
+from fuel_ext import parallel
+from fuel_ext.submit import DEFAULT_SOCKET
+
+
+LOG = logging.getLogger(__name__)
+
+
+class _Channel(object):
+    """Messages to a submitter, dropped once it went away."""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._closed = False
+        self._lock = threading.RLock()
+
+    def send(self, **message):
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                self._wfile.write(json.dumps(message) + '\n')
+                self._wfile.flush()
+            except socket.error:
+                # The job goes on, its log is still in the daemon log.
+                self._closed = True
+
+
+class _JobLogHandler(logging.Handler):
+    """Forwards the records logged on behalf of one job to its submitter.
+
+    Records handed over by a logs.QueueListener carry the job of the
+    thread which logged them, the others are handled in that thread.
+    """
+
+    def __init__(self, job, channel):
+        logging.Handler.__init__(self, logging.INFO)
+        self.job = job
+        self.channel = channel
+
+    def filter(self, record):
+        job = getattr(record, 'job', getattr(parallel.context, 'job', None))
+        return job == self.job
+
+    def emit(self, record):
+        self.channel.send(log=self.format(record))
+
+
+class _JobRequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        channel = _Channel(self.wfile)
+        try:
+            job = json.loads(self.rfile.readline())
+            paths = [str(path) for path in job['settings']]
+        except (ValueError, KeyError, TypeError) as e:
+            channel.send(output='', error='Invalid job: {0}'.format(e))
+            return
+        self.server.run(paths, job, channel)
+
+
+class Daemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """fuel-env job server listening on a Unix socket.
+
+    The socket is only accessible to the user running the daemon as jobs
+    carry credentials. `client_options` are passed to every NailgunClient.
+    The log of a job is streamed to its submitter by the `log_listener`
+    logs.setup() returned, or by the root logger without one.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path=DEFAULT_SOCKET, client_options=None,
+                 log_listener=None):
+        self.path = path
+        self.client_options = client_options
+        self.log_listener = log_listener
+        self.clients = {}
+        self._job_ids = itertools.count(1)
+        self._env_locks = collections.defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        self._remove_stale_socket()
+        umask = os.umask(0o077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path,
+                                                   _JobRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.path):
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            os.unlink(self.path)
+        else:
+            raise env.EnvError('fuel-env-daemon already listens on {0}'
+                               .format(self.path))
+        finally:
+            sock.close()
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _lock_envs(self, jobs):
+        with self._lock:
+            keys = sorted(set((settings['master_ip'], settings['env_name'])
+                              for settings in jobs.values()))
+            return [self._env_locks[key] for key in keys]
+
+    def _add_log_handler(self, handler):
+        if self.log_listener is not None:
+            self.log_listener.add_handler(handler)
+        else:
+            logging.getLogger().addHandler(handler)
+
+    def _remove_log_handler(self, handler):
+        # The records of the job still queued are sent before its result.
+        if self.log_listener is not None:
+            self.log_listener.remove_handler(handler)
+        else:
+            logging.getLogger().removeHandler(handler)
+
+    def run(self, paths, job, channel):
+        """Run a job, streaming its log and result over the channel."""
+        job_id = next(self._job_ids)
+        handler = _JobLogHandler(job_id, channel)
+        handler.setFormatter(env.log_formatter())
+        parallel.context.job = job_id
+        self._add_log_handler(handler)
+        output = StringIO.StringIO()
+        started = time.time()
+        try:
+            jobs = env.load_jobs(paths)
+            with self._lock:
+                env.connect(jobs, self.client_options, self.clients)
+                # What the previous jobs read may have changed since.
+                for client in self.clients.values():
+                    if client.cache is not None:
+                        client.cache.clear()
+            locks = self._lock_envs(jobs)
+            for lock in locks:
+                lock.acquire()
+            try:
+                results = env.build_envs(
+                    jobs, job.get('concurrency', 1),
+                    job.get('parallel_envs', 1), job.get('plan', False),
+                    clients=self.clients, resume=job.get('resume', False))
+            finally:
+                for lock in locks:
+                    lock.release()
+            error = env.report(results, job.get('plan', False), output,
+                               job.get('timings', False))
+        except Exception as e:
+            LOG.exception('Job %s failed', job_id)
+            error = str(e) or repr(e)
+        finally:
+            self._remove_log_handler(handler)
+            parallel.context.job = None
+        LOG.info('Job %s done in %.3fs: %s', job_id, time.time() - started,
+                 error or 'ok')
+        channel.send(output=output.getvalue(), error=error)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='fuel-env-daemon')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='Unix socket to listen on')
+    parser.add_argument('--log-file', default=env.LOG_FILE, metavar='PATH',
+                        help='file to log to as JSON lines, rotated by '
+                             'size (default: %(default)s)')
+    args = parser.parse_args()
+    listener = env.log_setup(log_file=args.log_file)
+    try:
+        server = Daemon(args.socket, log_listener=listener)
+    except (env.EnvError, socket.error) as e:
+        env.exit(str(e))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    LOG.info('Listening on %s', args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
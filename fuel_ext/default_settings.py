@@ -23,6 +23,17 @@ DEFAULT = {
     'nodes': {
         'default': None,
         'mandatory': True},
+    'disk_layouts': {
+        'default': {},
+        'mandatory': False},
+    'interface_templates': {
+        'default': {},
+        'mandatory': False},
+    # Interface the admin network goes to, or 'pxe' for the one with the
+    # MAC of the node.
+    'admin_interface': {
+        'default': 'eth0',
+        'mandatory': False},
     'env_name': {
         'default': None,
         'mandatory': True},
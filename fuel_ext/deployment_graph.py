@@ -0,0 +1,204 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import heapq
+
+# Tasks which only structure the graph and never run on a node.
+NON_EXECUTABLE_TYPES = ('stage', 'group', 'skipped')
+
+
+class CycleError(Exception):
+    """Raised when the tasks depend on each other in a cycle."""
+
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super(CycleError, self).__init__(
+            'Deployment tasks form a cycle: {0}'.format(' -> '.join(cycle)))
+
+
+def _restricted(task, task_ids):
+    # Dependencies on tasks left out of a subgraph must not show up in its
+    # `missing` set.
+    task = dict(task)
+    for key in ('requires', 'required_for'):
+        if task.get(key):
+            task[key] = [t for t in task[key] if t in task_ids]
+    return task
+
+
+class DeploymentGraph(object):
+    """Deployment tasks of a cluster or release, with their dependencies.
+
+    Built from the task list Nailgun returns: a task runs after the tasks
+    in its `requires` and before those in its `required_for`. References
+    to tasks which are not in the list are ignored, and kept in `missing`.
+    Everything (ordering, start/end selection, tasks of a node) is then
+    computed locally instead of being asked to the server.
+    """
+
+    def __init__(self, tasks):
+        self.tasks = collections.OrderedDict(
+            (task['id'], task) for task in tasks)
+        self.successors = dict((task_id, set()) for task_id in self.tasks)
+        self.predecessors = dict((task_id, set()) for task_id in self.tasks)
+        self.missing = set()
+        for task_id, task in self.tasks.iteritems():
+            for required in task.get('requires') or ():
+                self._add_edge(required, task_id)
+            for required_for in task.get('required_for') or ():
+                self._add_edge(task_id, required_for)
+        self._order = None
+
+    def _add_edge(self, before, after):
+        if before not in self.tasks or after not in self.tasks:
+            self.missing.update(t for t in (before, after)
+                                if t not in self.tasks)
+            return
+        self.successors[before].add(after)
+        self.predecessors[after].add(before)
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, task_id):
+        return task_id in self.tasks
+
+    def __iter__(self):
+        return iter(self.topological_order())
+
+    def find_cycle(self):
+        """Return a list of task IDs forming a cycle, None if there's none."""
+        state = {}  # task ID: 1 while on the DFS path, 2 once done
+        for root in self.tasks:
+            if root in state:
+                continue
+            path = [root]
+            stack = [iter(sorted(self.successors[root]))]
+            state[root] = 1
+            while stack:
+                for task_id in stack[-1]:
+                    if state.get(task_id) == 1:
+                        return path[path.index(task_id):] + [task_id]
+                    if task_id not in state:
+                        state[task_id] = 1
+                        path.append(task_id)
+                        stack.append(iter(sorted(self.successors[task_id])))
+                        break
+                else:
+                    state[path.pop()] = 2
+                    stack.pop()
+        return None
+
+    def topological_order(self):
+        """Return the task IDs so that every task follows its requirements.
+
+        Ties are broken by task ID, so the order is stable between calls.
+        Raises CycleError if there is no such order.
+        """
+        if self._order is None:
+            indegree = dict((task_id, len(before))
+                            for task_id, before in self.predecessors.items())
+            ready = [task_id for task_id, n in indegree.items() if n == 0]
+            heapq.heapify(ready)
+            order = []
+            while ready:
+                task_id = heapq.heappop(ready)
+                order.append(task_id)
+                for after in self.successors[task_id]:
+                    indegree[after] -= 1
+                    if indegree[after] == 0:
+                        heapq.heappush(ready, after)
+            if len(order) != len(self.tasks):
+                raise CycleError(self.find_cycle())
+            self._order = order
+        return list(self._order)
+
+    def _reachable(self, task_id, edges):
+        seen = set()
+        queue = collections.deque([task_id])
+        while queue:
+            for other in edges[queue.popleft()]:
+                if other not in seen:
+                    seen.add(other)
+                    queue.append(other)
+        return seen
+
+    def ancestors(self, task_id):
+        """Return the IDs of all the tasks `task_id` requires."""
+        return self._reachable(task_id, self.predecessors)
+
+    def descendants(self, task_id):
+        """Return the IDs of all the tasks requiring `task_id`."""
+        return self._reachable(task_id, self.successors)
+
+    def subgraph(self, start=None, end=None, include=()):
+        """Return the graph of the tasks between start and end, inclusive.
+
+        Same selection as the start and end parameters of the Nailgun
+        deployment_tasks API: `end` alone selects it and every task it
+        requires, `start` alone it and every task requiring it, both the
+        tasks on the paths from start to end. Tasks in `include` are added.
+        """
+        for task_id in (start, end) + tuple(include):
+            if task_id is not None and task_id not in self.tasks:
+                raise KeyError('No deployment task {0}'.format(task_id))
+        selected = set(self.tasks)
+        if end is not None:
+            selected &= self.ancestors(end) | set([end])
+        if start is not None:
+            selected &= self.descendants(start) | set([start])
+        selected.update(include)
+        return DeploymentGraph(
+            _restricted(task, selected)
+            for task_id, task in self.tasks.iteritems() if task_id in selected)
+
+    def tasks_for_roles(self, roles):
+        """Return the IDs of the tasks run on a node with these roles.
+
+        Stages, groups and skipped tasks are left out. The IDs are in
+        topological order.
+        """
+        roles = set(roles)
+        selected = []
+        for task_id in self.topological_order():
+            task = self.tasks[task_id]
+            if task.get('type') in NON_EXECUTABLE_TYPES:
+                continue
+            task_roles = task.get('role', task.get('groups'))
+            if task_roles == '*' or (
+                    task_roles and roles & set(
+                        [task_roles] if isinstance(task_roles, basestring)
+                        else task_roles)):
+                selected.append(task_id)
+        return selected
+
+    def plan(self, nodes):
+        """Return [(node IDs, task IDs)], nodes running the same tasks once.
+
+        `nodes` are Nailgun nodes, their roles and pending roles decide the
+        tasks they run. Each item maps to one put_deployment_tasks_for_cluster
+        call. Nodes without tasks are left out.
+        """
+        by_roles = {}
+        groups = collections.OrderedDict()
+        for node in sorted(nodes, key=lambda n: n['id']):
+            roles = tuple(sorted(set(node.get('roles') or []) |
+                                 set(node.get('pending_roles') or [])))
+            if roles not in by_roles:
+                by_roles[roles] = tuple(self.tasks_for_roles(roles))
+            if by_roles[roles]:
+                groups.setdefault(by_roles[roles], []).append(node['id'])
+        return [(node_ids, list(task_ids))
+                for task_ids, node_ids in groups.iteritems()]
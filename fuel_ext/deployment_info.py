@@ -0,0 +1,191 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Orchestrator deployment info exported to disk, one file per node.
+
+export() streams the payload of a cluster from the API, writing each node
+(one entry per node and role) to its own gzipped JSON file as soon as it
+is decoded, then an index.json listing the files with a digest of each.
+DeploymentInfo reads an export back, loading a node only when asked for,
+and diff() compares two exports, loading only the nodes whose digests
+differ:
+
+    fuel-deployment-info export 1 /tmp/before
+    ... redeploy ...
+    fuel-deployment-info export 1 /tmp/after
+    fuel-deployment-info diff /tmp/before /tmp/after
+"""
+
+import argparse
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+from fuel_ext import default_settings
+from fuel_ext.nailgun_client import NailgunClient
+from fuel_ext import plan
+
+
+LOG = logging.getLogger(__name__)
+
+INDEX = 'index.json'
+SUFFIX = '.json.gz'
+
+
+def _file_name(uid, role):
+    return re.sub(r'[^\w.-]', '_', '{0}-{1}'.format(uid, role)) + SUFFIX
+
+
+def _write_atomic(path, write):
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    write(tmp_path)
+    os.rename(tmp_path, path)
+
+
+def export(client, cluster_id, directory, compresslevel=6):
+    """Stream the deployment info of a cluster to `directory`.
+
+    Only one node is held in memory at a time. Files of a previous export
+    to the same directory which are not part of this one are removed once
+    the new index is written. Returns the index.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    entries = []
+    for node in client.iter_deployment_info(cluster_id):
+        # Keys are sorted for equal nodes to get equal digests.
+        data = json.dumps(node, separators=(',', ':'), sort_keys=True)
+        name = _file_name(node.get('uid'), node.get('role'))
+
+        def write(path):
+            with gzip.GzipFile(path, 'wb', compresslevel) as f:
+                f.write(data)
+
+        _write_atomic(os.path.join(directory, name), write)
+        entries.append({'uid': node.get('uid'), 'role': node.get('role'),
+                        'file': name, 'size': len(data),
+                        'sha1': hashlib.sha1(data).hexdigest()})
+    index = {'cluster_id': cluster_id,
+             'exported_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+             'nodes': entries}
+
+    def write_index(path):
+        with open(path, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+
+    _write_atomic(os.path.join(directory, INDEX), write_index)
+    exported = set(e['file'] for e in entries)
+    for name in os.listdir(directory):
+        if name.endswith(SUFFIX) and name not in exported:
+            os.unlink(os.path.join(directory, name))
+    LOG.info('Exported deployment info of %s node(s) of cluster %s to %s',
+             len(entries), cluster_id, directory)
+    return index
+
+
+class DeploymentInfo(object):
+    """An export read back, nodes keyed by (uid, role) and loaded lazily."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX)) as f:
+            self.index = json.load(f)
+        self._entries = collections.OrderedDict(
+            ((e['uid'], e['role']), e) for e in self.index['nodes'])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        return self._entries.keys()
+
+    def digest(self, key):
+        return self._entries[key]['sha1']
+
+    def __getitem__(self, key):
+        path = os.path.join(self.directory, self._entries[key]['file'])
+        with gzip.GzipFile(path, 'rb') as f:
+            return json.load(f)
+
+    def for_uid(self, uid):
+        """Return the entries of one node, a {role: info} dict."""
+        return dict((role, self[(u, role)]) for u, role in self._entries
+                    if u == str(uid))
+
+
+def diff(old, new):
+    """Return the Plan of the changes between two DeploymentInfo exports.
+
+    Nodes with the same digest are not loaded, those with equal data
+    are not reported.
+    """
+    changes = plan.Plan()
+    for key in sorted(set(old) | set(new)):
+        label = 'node {0} ({1})'.format(*key)
+        if key not in new:
+            changes.add('removed', label, [])
+        elif key not in old:
+            changes.add('added', label, [])
+        elif old.digest(key) != new.digest(key):
+            # Exports made before keys were sorted differ in digest only.
+            delta = plan.diff(old[key], new[key])
+            if delta:
+                changes.add('changed', label, delta)
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='fuel-deployment-info')
+    subparsers = parser.add_subparsers(dest='command')
+    export_parser = subparsers.add_parser(
+        'export', help='export the deployment info of a cluster')
+    export_parser.add_argument('cluster_id', type=int)
+    export_parser.add_argument('directory')
+    for option in ('username', 'password', 'tenant_name'):
+        export_parser.add_argument(
+            '--' + option.replace('_', '-'),
+            default=default_settings.DEFAULT[option]['default'])
+    export_parser.add_argument('--master-ip', default='10.20.0.2')
+    diff_parser = subparsers.add_parser(
+        'diff', help='print the changes between two exports')
+    diff_parser.add_argument('old')
+    diff_parser.add_argument('new')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'export':
+        client = NailgunClient(args.master_ip, args.username, args.password,
+                               args.tenant_name)
+        export(client, args.cluster_id, args.directory)
+    else:
+        changes = diff(DeploymentInfo(args.old), DeploymentInfo(args.new))
+        sys.stdout.write(changes.format() + '\n')
+        if changes:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Disk layouts of the settings turned into volumes of node disks.
+
+A layout is {disk name: {volume name: size}}, a size being a number of
+MB, a percentage of the disk ("40%") or "rest" for what the other volumes
+of the disk leave. It is given per node ("disks") or per role
+("disk_layouts"), a node without its own layout taking, disk by disk,
+the layout of its first role which has one:
+
+    "disk_layouts": {"compute": {"sda": {"os": 50000, "vm": "rest"}}}
+
+Nodes with the same disks (names, sizes and volumes they may hold) and
+the same layout get the same volumes, so they are computed once.
+"""
+
+import collections
+import copy
+import json
+import re
+
+REST = 'rest'
+_PERCENT = re.compile(r'^(\d+(?:\.\d+)?)%$')
+
+
+class LayoutError(Exception):
+    """Raised when a layout does not fit a disk."""
+
+
+def parse_size(size):
+    """Return ('mb', n), ('percent', n) or ('rest', None) for a size.
+
+    Raises ValueError if it is none of those.
+    """
+    if isinstance(size, (int, long)) and not isinstance(size, bool):
+        if size < 0:
+            raise ValueError('size {0} is negative'.format(size))
+        return 'mb', size
+    if isinstance(size, basestring):
+        if size == REST:
+            return REST, None
+        match = _PERCENT.match(size)
+        if match and float(match.group(1)) <= 100:
+            return 'percent', float(match.group(1))
+    raise ValueError('size {0!r} is not a number of MB, a percentage or '
+                     '"{1}"'.format(size, REST))
+
+
+def resolve(volumes, disk_size):
+    """Return {volume: MB} of a disk layout on a disk of disk_size MB.
+
+    Percentages are rounded down, "rest" gets what is left after the
+    other volumes. Raises LayoutError if the volumes do not fit.
+    """
+    sizes = {}
+    rest = []
+    for volume, size in volumes.iteritems():
+        kind, value = parse_size(size)
+        if kind == 'mb':
+            sizes[volume] = value
+        elif kind == 'percent':
+            sizes[volume] = int(disk_size * value / 100)
+        else:
+            rest.append(volume)
+    if len(rest) > 1:
+        raise LayoutError('only one volume can take the rest of a disk, '
+                          'not {0}'.format(', '.join(sorted(rest))))
+    used = sum(sizes.values())
+    if used > disk_size:
+        raise LayoutError('volumes take {0} MB, the disk has {1} MB'.format(
+            used, disk_size))
+    for volume in rest:
+        sizes[volume] = disk_size - used
+    return sizes
+
+
+def fingerprint(disks):
+    """Return what a layout applied to `disks` depends on, hashable."""
+    return tuple(sorted(
+        (disk['name'], disk['size'],
+         tuple(sorted(v['name'] for v in disk.get('volumes') or [])))
+        for disk in disks))
+
+
+def node_layout(node, role_layouts):
+    """Return the layout of a node from the settings, None if it has none.
+
+    Its own "disks", else per disk the layout of its first role which has
+    one for that disk.
+    """
+    if node.get('disks') is not None:
+        return node['disks']
+    layout = {}
+    for role in node.get('roles') or []:
+        for disk, volumes in (role_layouts.get(role) or {}).iteritems():
+            layout.setdefault(disk, volumes)
+    return layout or None
+
+
+class DiskLayoutPlanner(object):
+    """Volumes of node disks for layouts, memoized by disk geometry.
+
+    Planning hundreds of nodes with a few hardware profiles resolves each
+    (profile, layout) pair once; `stats` counts the pairs computed and
+    the nodes which reused one.
+    """
+
+    def __init__(self, role_layouts=None):
+        self.role_layouts = role_layouts or {}
+        self.stats = collections.Counter()
+        self._volumes = {}
+
+    def layout_for(self, node):
+        return node_layout(node, self.role_layouts)
+
+    def volumes(self, disks, layout):
+        """Return {disk name: {volume: MB}} of a layout on `disks`.
+
+        Disks not in the layout are left out. Raises LayoutError.
+        """
+        key = (fingerprint(disks), json.dumps(layout, sort_keys=True))
+        if key in self._volumes:
+            self.stats['reused'] += 1
+            return self._volumes[key]
+        sizes = dict((disk['name'], disk['size']) for disk in disks)
+        volumes = {}
+        for name, disk_volumes in layout.iteritems():
+            if name not in sizes:
+                raise LayoutError('no disk {0}'.format(name))
+            try:
+                volumes[name] = resolve(disk_volumes, sizes[name])
+            except (LayoutError, ValueError) as e:
+                raise LayoutError('{0}: {1}'.format(name, e))
+        self.stats['planned'] += 1
+        self._volumes[key] = volumes
+        return volumes
+
+    def apply(self, disks, layout):
+        """Return a copy of `disks` (get_node_disks) with the layout set.
+
+        The volumes of a disk in the layout are replaced by those of the
+        layout.
+        """
+        volumes = self.volumes(disks, layout)
+        disks = copy.deepcopy(disks)
+        for disk in disks:
+            if disk['name'] in volumes:
+                disk['volumes'] = [
+                    {'name': name, 'size': size}
+                    for name, size in sorted(volumes[disk['name']].items())]
+        return disks
@@ -12,32 +12,103 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import argparse
+import copy
 import json
 import logging
-import logging.handlers
 import os
 import os.path
 import sys
+import time
 import urllib2
 
 from fuel_ext import default_settings
+from fuel_ext import disk_layout
+from fuel_ext import interface_layout
+from fuel_ext import journal
+from fuel_ext import logs
+from fuel_ext import metrics
 from fuel_ext import nailgun_client
+from fuel_ext import parallel
+from fuel_ext import plan
+from fuel_ext import steps
+from fuel_ext import task_waiter
+from fuel_ext import validation
 
 
 LOG = logging.getLogger(__name__)
-_LOG_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 LOG_FILE = '/var/log/fuel_ext.log'
 
 
-if not os.path.exists(LOG_FILE):
-    open(LOG_FILE, 'a').close()
+class EnvError(Exception):
+    """Raised when an environment can not be built."""
 
 
 def exit(message):
-    LOG(message)
+    LOG.error(message)
     sys.exit(message)
 
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='fuel-env')
+    parser.add_argument('settings', nargs='+',
+                        help='settings JSON file, or a directory of them; '
+                             'several environments are built in one run')
+    parser.add_argument('--concurrency', type=int, default=1, metavar='N',
+                        help='number of nodes processed in parallel')
+    parser.add_argument('--parallel-envs', type=int, default=1, metavar='N',
+                        help='number of environments built in parallel')
+    parser.add_argument('--plan', action='store_true',
+                        help='only print the changes a build would make')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the steps a previous build of the same '
+                             'settings recorded as done in its journal')
+    parser.add_argument('--timings', action='store_true',
+                        help='print how long each build step took, the '
+                             'steps on the critical path marked with *')
+    parser.add_argument('--log-file', default=LOG_FILE, metavar='PATH',
+                        help='file to log to as JSON lines, rotated by '
+                             'size (default: %(default)s)')
+    parser.add_argument('--metrics-json', metavar='PATH',
+                        help='write per-endpoint API request metrics as '
+                             'JSON to PATH at exit')
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                        help='write them as a Prometheus textfile to PATH')
+    return parser.parse_args(argv)
+
+
+def map_nodes(func, keys, concurrency):
+    try:
+        return parallel.map_keys(func, keys, concurrency)
+    except parallel.ParallelError as e:
+        raise EnvError('Failed for %s node(s):\n%s' % (len(e.errors), e))
+
+
+def find_settings_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith('.json')))
+        else:
+            files.append(path)
+    return files
+
+
+def load_settings(path):
+    try:
+        with open(path, 'r') as f:
+            json_settings = f.read()
+    except IOError as e:
+        raise EnvError('%s: %s' % (path, e))
+    try:
+        settings = json.loads(json_settings)
+    except ValueError as e:
+        raise EnvError('%s: %s' % (path, e))
+    return parse_settings(settings)
+
+
 def parse_settings(settings):
     res = {}
     for k, v in default_settings.DEFAULT.iteritems():
@@ -46,175 +117,560 @@ def parse_settings(settings):
             continue
         if v['mandatory'] and v['default'] is None:
             message = 'Key `%s` is mandatory' % k
-            exit(message)
+            raise EnvError(message)
         res[k] = v['default']
+    try:
+        validation.validate_settings(res)
+    except validation.ValidationError as e:
+        raise EnvError(str(e))
     return res
 
 
-def log_setup(log_file=None):
-    formatter = logging.Formatter(
+def log_formatter():
+    return logs.RedactingFormatter(
         '%(asctime)s %(levelname)s (%(module)s) %(message)s',
-        _LOG_TIME_FORMAT)
-    log = logging.getLogger(None)
-    stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(logging.INFO)
-    stream_handler.setFormatter(formatter)
-    log.addHandler(stream_handler)
-
-    if log_file:
-        file_handler = logging.handlers.WatchedFileHandler(log_file)
-        file_handler.setLevel(logging.DEBUG)
-        mode = int('0644', 8)
-        os.chmod(log_file, mode)
-        file_handler.setFormatter(formatter)
-        log.addHandler(file_handler)
-
-    log.setLevel(logging.INFO)
-
-
-def update_interfaces(old_ifaces, new_ifaces, networks):
-    supported = ['private', 'public', 'storage', 'management']
-    updated = []
-    for v in new_ifaces.values():
-        updated.extend(v)
-    diff = set(supported) - set(updated)
-    if diff:
-        message = "Networks %s should be assigned." % diff
-        exit(message)
-    nets = dict((n['name'],
-                 {"id": n['id'],
-                  "name": n['name']}) for n in networks['networks'])
-    for net in old_ifaces:
-        if net['name'] not in new_ifaces.keys():
-            continue
-        assigned_networks = [nets[p] for p in new_ifaces[net['name']]]
-        if net['name'] == 'eth0':
-            assigned_networks.append(nets['fuelweb_admin'])
-        net['assigned_networks'] = assigned_networks
+        logs.TIME_FORMAT)
 
 
-def update_disks(disks, settings_disks, mac):
-        node_disks = dict((v['name'], v) for v in disks[mac])
-        changed = set(node_disks.keys()) & set(settings_disks.keys())
-        for disk_name in changed:
-            node_disks[disk_name]['volumes'] = [
-                {"name": k, "size": v}
-                for k, v in settings_disks[disk_name].iteritems()]
-        return node_disks.values()
+def log_setup(log_file=None):
+    """Log to stderr, and to log_file as JSON lines, off the caller threads.
 
+    The file is created, and rotated by size, by the handler (see logs).
+    """
+    return logs.setup(log_file=log_file, console_formatter=log_formatter())
 
-def main():
-    log_setup(log_file=LOG_FILE)
-    LOG.info('Start service.')
-    argv = sys.argv
-    if len(argv) < 2:
-        message = 'You should use fuel-env PATH_TO_YOUR_SETTINGS_JSON'
-        exit(message)
-    json_settings_file = argv[1]
-    with open(json_settings_file, 'r') as f:
-        json_settings = f.read()
-    try:
-        settings = json.loads(json_settings)
-    except Exception as e:
-        exit(e.message)
-    settings = parse_settings(settings)
-    LOG.info('Used settings: %s' % settings)
-    client = nailgun_client.NailgunClient(settings['master_ip'],
-                                          settings['username'],
-                                          settings['password'],
-                                          settings['tenant_name'])
-
-    data = {
-        'name': settings['env_name'],
-        'release_id': 2,
-        'net_provider': 'neutron',
-        'net_segment_type': 'vlan'}
 
-    try:
-        cluster_id = client.create_cluster(data)['id']
-    except urllib2.HTTPError as e:
-        message = json.loads(e.read())['message']
-        exit(message)
-
-    # Update cluster settings:
-    # - enable gamma-lcp-ui plugin,
-    # - enable KVM hypervisor,
-    # - enable assignment public network to all nodes,
-    # - update repos.
-    cluster_settings = client.get_cluster_attributes(cluster_id)
-    cluster_settings[
-        'editable']['gamma-lcp-ui']['metadata']['enabled'] = True
-    cluster_settings['editable']['common']['libvirt_type']['value'] = 'kvm'
-    cluster_settings[
-        'editable']['public_network_assignment'][
+def configure_cluster_attributes(attributes, settings):
+    """Apply the settings to cluster attributes in place.
+
+    - enable gamma-lcp-ui plugin,
+    - enable KVM hypervisor,
+    - enable assignment public network to all nodes,
+    - update repos.
+    """
+    editable = attributes['editable']
+    editable['gamma-lcp-ui']['metadata']['enabled'] = True
+    editable['common']['libvirt_type']['value'] = 'kvm'
+    editable['public_network_assignment'][
         'assign_to_all_nodes']['value'] = True
-    cluster_settings[
-        'editable']['repo_setup']['repos']['value'] = settings['repos']
-    client.update_cluster_attributes(cluster_id, cluster_settings)
+    editable['repo_setup']['repos']['value'] = settings['repos']
 
-    # Update networking Public section.
-    networks = client.get_networks(cluster_id)
+
+def configure_networks(networks, settings):
+    """Apply the Public section of the settings to networks in place."""
     all_networks = dict((n['name'], n) for n in networks['networks'])
     all_networks['public'].update(settings['networks']['public_network'])
     networks['networks'] = all_networks.values()
     networks[
         'networking_parameters'][
         'floating_ranges'] = settings['networks']['floating_ranges']
-    client.update_networks(cluster_id, networks)
-
-    # Update nodes info.
-    nodes = client.get_nodes()
-    nodes = dict((n['mac'], n) for n in nodes)
-    disks = dict(
-        (k, client.get_node_disks(v['id'])) for k, v in nodes.iteritems())
-
-    nodes_roles = []
-    interfaces = {}
-    updated_disks = {}
-    # Prepare data for roles, interfaces and volumes.
-    for node in settings['nodes']:
-        mac = node['mac']
-        settings_interfaces = node.get('interfaces')
-        settings_disks = node.get('disks', None)
-        node_id = nodes[mac]['id']
-
-        if mac not in nodes:
-            message = "Node witn MAC %s is not available" % node['mac']
-            exit(message)
-        # Set roles.
-        nodes_roles.append({
-            'id': node_id,
-            'roles': node['roles'],
-        })
-        # Set interfaces.
-        if settings_interfaces is not None:
-            ifaces = client.get_node_interfaces(node_id)
-            update_interfaces(ifaces,
-                              settings_interfaces,
-                              networks)
-            interfaces[node_id] = ifaces
-
-        # Set disks.
-        if settings_disks is not None:
-            updated_disks[node_id] = update_disks(disks, settings_disks, mac)
-
-    # Add nodes roles.
-    client.add_nodes(cluster_id, nodes_roles)
-    # Update nodes volumes.
-    for node_id, disks in updated_disks.iteritems():
-        client.put_node_disks(node_id, disks)
-
-    nodes = client.get_nodes()
-    nodes = dict((n['mac'], n) for n in nodes)
-    for node in settings['nodes']:
-        mac = node['mac']
-        if 'name' in node:
-            nodes[mac]['name'] = node['name']
-    client.update_nodes(nodes.values())
-
-    # Update nodes interfaces
-    for node_id, ifaces in interfaces.iteritems():
-        client.put_node_interfaces(node_id, ifaces)
-
-    # Deploy changes.
-    client.deploy_cluster_changes(cluster_id)
+
+
+# Steps of build_env() and the steps each of them requires. Roles go
+# before disks and interfaces: what a node may be given depends on them.
+ENV_STEPS = (
+    ('nodes', ()),
+    ('node disks', ('nodes',)),
+    ('node interfaces', ('nodes',)),
+    ('validate', ('nodes', 'node disks', 'node interfaces')),
+    ('cluster', ('validate',)),
+    ('attributes', ('cluster',)),
+    ('networks', ('cluster',)),
+    ('roles', ('cluster',)),
+    ('names', ('cluster',)),
+    ('disks', ('roles',)),
+    ('interfaces', ('roles', 'networks')),
+    ('deploy', ('attributes', 'networks', 'roles', 'names', 'disks',
+                'interfaces')),
+)
+
+
+# Cluster statuses deployed again even if the build changed nothing.
+REDEPLOY_STATUSES = ('new', 'error', 'stopped')
+# Cluster statuses and tasks of a deployment (or removal) under way, the
+# cluster is not changed meanwhile.
+BUSY_STATUSES = ('deployment', 'remove', 'update')
+BUSY_TASKS = ('deploy', 'deployment', 'provision', 'stop_deployment',
+              'reset_environment', 'update', 'cluster_deletion')
+
+
+def node_label(node):
+    return 'node-%s (%s)' % (node['id'], node['mac'])
+
+
+def step_digests(settings):
+    """Return {step: digest of the settings it depends on}.
+
+    Only the steps of build_env() which are recorded in its journal.
+    """
+    nodes = settings['nodes']
+    return dict((step, journal.digest(data)) for step, data in (
+        ('cluster', settings['env_name']),
+        ('attributes', settings['repos']),
+        ('networks', settings['networks']),
+        ('roles', [(n['mac'], n['roles']) for n in nodes]),
+        ('names', [(n['mac'], n.get('name')) for n in nodes]),
+        ('disks', [settings['disk_layouts'],
+                   [(n['mac'], n['roles'], n.get('disks')) for n in nodes]]),
+        ('interfaces', [settings['interface_templates'],
+                        settings['admin_interface'],
+                        [(n['mac'], n['roles'], n.get('interfaces'))
+                         for n in nodes]]),
+        ('deploy', settings)))
+
+
+def build_env(client, settings, concurrency=1, dry_run=False,
+              build_journal=None, resume=False):
+    """Bring the environment in line with the settings.
+
+    The current state is fetched first and only what differs from the
+    settings is written, so building an environment which is already
+    up to date makes no write calls. The build is a set of steps run as
+    soon as the steps they depend on are done (see ENV_STEPS). Returns
+    the cluster ID (None if a dry run found no cluster), the Plan of the
+    changes and the Timings of the steps; with dry_run the changes are
+    only planned.
+
+    With a Journal the steps done are recorded in it, it is started
+    afresh unless `resume` is set. With resume the steps it has recorded
+    for the same settings are skipped, as well as fetching what only
+    they need, once the cluster is found to be the one it recorded.
+    """
+    plans = dict((name, plan.Plan()) for name, _ in ENV_STEPS)
+    digests = step_digests(settings)
+    planner = disk_layout.DiskLayoutPlanner(settings['disk_layouts'])
+    recorded_cluster = None
+    skipped = set()
+    # {cluster ID: reason} of a cluster a dry run found being deployed,
+    # it is not planned to be deployed again.
+    under_way = {}
+    if build_journal is not None:
+        if resume:
+            build_journal.load()
+            recorded_cluster = build_journal.done('cluster',
+                                                  digests['cluster'])
+        elif not dry_run:
+            build_journal.reset()
+    if recorded_cluster is not None:
+        skipped = set(step for step in digests if step != 'cluster' and
+                      build_journal.done(step, digests[step]))
+        LOG.info('Resuming the build of environment %s (cluster %s) '
+                 'from %s, skipping: %s', settings['env_name'],
+                 recorded_cluster['cluster_id'], build_journal.path,
+                 ', '.join(sorted(skipped)) or 'nothing')
+
+    # The inventory is fetched and checked before anything is written:
+    # all nodes, then disks and interfaces of the nodes in the settings.
+    # Nodes, their disks and interfaces are keyed by lowercase MAC, the
+    # settings may spell MACs in any case.
+    def fetch_nodes(results):
+        return dict((n['mac'].lower(), n) for n in client.get_nodes())
+
+    def configured(nodes, layout_for):
+        return [n['mac'].lower() for n in settings['nodes']
+                if n['mac'].lower() in nodes and layout_for(n) is not None]
+
+    def fetch_disks(results):
+        if 'disks' in skipped:
+            return {}
+        nodes = results['nodes']
+        return map_nodes(
+            lambda mac: client.get_node_disks(nodes[mac]['id']),
+            configured(nodes, planner.layout_for), concurrency)
+
+    def fetch_interfaces(results):
+        if 'interfaces' in skipped:
+            return {}
+        nodes = results['nodes']
+        return map_nodes(
+            lambda mac: client.get_node_interfaces(nodes[mac]['id']),
+            configured(nodes, lambda n: interface_layout.node_layout(
+                n, settings['interface_templates'])),
+            concurrency)
+
+    def validate(results):
+        try:
+            validation.validate_inventory(settings, results['nodes'],
+                                          results['node interfaces'],
+                                          results['node disks'])
+        except validation.ValidationError as e:
+            raise EnvError(str(e))
+
+    def deployment_under_way(cluster_id, status):
+        # What keeps the cluster from being changed, None if nothing.
+        if status in BUSY_STATUSES:
+            return 'its status is %s' % status
+        for task in client.iter_tasks():
+            if (task.get('cluster') == cluster_id and
+                    task.get('name') in BUSY_TASKS and
+                    task.get('status') not in task_waiter.FINAL_STATUSES):
+                return 'task %s (%s) is %s' % (task['id'], task['name'],
+                                               task.get('status'))
+        return None
+
+    def find_cluster(results):
+        # The list is read instead of get_cluster(): the status must be
+        # fresh.
+        for item in client.list_clusters():
+            if item['name'] == settings['env_name']:
+                if (recorded_cluster is not None and
+                        item['id'] != recorded_cluster['cluster_id']):
+                    raise EnvError(
+                        'Cluster %s is not the cluster %s of the journal, '
+                        'build without --resume' % (
+                            item['id'], recorded_cluster['cluster_id']))
+                # Nothing is written to a cluster being deployed.
+                busy = deployment_under_way(item['id'], item.get('status'))
+                if busy is not None:
+                    if not dry_run:
+                        raise EnvError(
+                            'Cluster %s is being deployed (%s), build again '
+                            'once it is done' % (item['id'], busy))
+                    LOG.warning('Cluster %s is being deployed (%s), the '
+                                'changes can not be made now',
+                                item['id'], busy)
+                    under_way[item['id']] = busy
+                return item
+        if recorded_cluster is not None:
+            raise EnvError('Cluster %s of the journal is gone, build '
+                           'without --resume' %
+                           recorded_cluster['cluster_id'])
+        data = {
+            'name': settings['env_name'],
+            'release_id': 2,
+            'net_provider': 'neutron',
+            'net_segment_type': 'vlan'}
+        plans['cluster'].add('create cluster', settings['env_name'],
+                             plan.diff(None, data))
+        if dry_run:
+            return None
+        try:
+            return client.create_cluster(data)
+        except urllib2.HTTPError as e:
+            message = json.loads(e.read())['message']
+            raise EnvError(message)
+
+    def for_cluster(func):
+        # A dry run without a cluster only plans its creation.
+        def step(results):
+            if results['cluster'] is not None:
+                return func(results['cluster']['id'], results)
+        return step
+
+    def journaled(name, func):
+        def step(results):
+            if name in skipped:
+                LOG.info('Step %s of environment %s is done already',
+                         name, settings['env_name'])
+                return None
+            result = func(results)
+            if build_journal is not None and not dry_run:
+                cluster = result if name == 'cluster' else results['cluster']
+                build_journal.record(name, digests[name],
+                                     changed=bool(plans[name]),
+                                     cluster_id=cluster['id'])
+            return result
+        return step
+
+    @for_cluster
+    def update_attributes(cluster_id, results):
+        current = client.get_cluster_attributes(cluster_id)
+        cluster_settings = copy.deepcopy(current)
+        configure_cluster_attributes(cluster_settings, settings)
+        delta = plan.diff(current, cluster_settings)
+        if delta:
+            plans['attributes'].add('update attributes of cluster',
+                                    cluster_id, delta)
+            if not dry_run:
+                client.update_cluster_attributes(cluster_id,
+                                                 cluster_settings)
+
+    # Update networking Public section.
+    @for_cluster
+    def update_networks(cluster_id, results):
+        current = client.get_networks(cluster_id)
+        networks = copy.deepcopy(current)
+        configure_networks(networks, settings)
+        delta = plan.diff(current, networks)
+        if delta:
+            plans['networks'].add('update networks of cluster', cluster_id,
+                                  delta)
+            if not dry_run:
+                client.update_networks(cluster_id, networks)
+        return networks
+
+    @for_cluster
+    def assign_roles(cluster_id, results):
+        nodes_roles = []
+        for node in settings['nodes']:
+            current_node = results['nodes'][node['mac'].lower()]
+            current_roles = None
+            if current_node.get('cluster') == cluster_id:
+                current_roles = sorted(
+                    set(current_node.get('roles') or []) |
+                    set(current_node.get('pending_roles') or []))
+            if current_roles != sorted(node['roles']):
+                plans['roles'].add(
+                    'assign roles to', node_label(current_node),
+                    plan.diff(current_roles, sorted(node['roles'])))
+                nodes_roles.append({
+                    'id': current_node['id'],
+                    'roles': node['roles'],
+                })
+        if nodes_roles and not dry_run:
+            client.add_nodes(cluster_id, nodes_roles)
+
+    @for_cluster
+    def rename_nodes(cluster_id, results):
+        nodes_names = []
+        for node in settings['nodes']:
+            current_node = results['nodes'][node['mac'].lower()]
+            if 'name' in node and node['name'] != current_node.get('name'):
+                plans['names'].add(
+                    'rename', node_label(current_node),
+                    plan.diff(current_node.get('name'), node['name']))
+                nodes_names.append({'id': current_node['id'],
+                                    'name': node['name']})
+        # Only the names of the nodes from the settings are sent.
+        if nodes_names and not dry_run:
+            client.update_nodes(nodes_names)
+
+    @for_cluster
+    def put_disks(cluster_id, results):
+        disks = results['node disks']
+        updated_disks = {}
+        for node in settings['nodes']:
+            layout = planner.layout_for(node)
+            if layout is None:
+                continue
+            mac = node['mac'].lower()
+            current_node = results['nodes'][mac]
+            try:
+                node_disks = planner.apply(disks[mac], layout)
+            except disk_layout.LayoutError as e:
+                raise EnvError('%s: %s' % (node_label(current_node), e))
+            delta = plan.diff(disks[mac], node_disks)
+            if delta:
+                plans['disks'].add('update disks of',
+                                   node_label(current_node), delta)
+                updated_disks[current_node['id']] = node_disks
+        LOG.debug('Disk layouts computed %s time(s), reused %s time(s)',
+                  planner.stats['planned'], planner.stats['reused'])
+        if not dry_run:
+            map_nodes(
+                lambda node_id: client.put_node_disks(
+                    node_id, updated_disks[node_id]),
+                updated_disks, concurrency)
+
+    @for_cluster
+    def put_interfaces(cluster_id, results):
+        node_interfaces = results['node interfaces']
+        # Not returned when the networks step was skipped.
+        networks = results['networks'] or client.get_networks(cluster_id)
+        interface_planner = interface_layout.InterfacePlanner(
+            networks, settings['interface_templates'],
+            settings['admin_interface'])
+        interfaces = {}
+        for node in settings['nodes']:
+            layout = interface_planner.layout_for(node)
+            if layout is None:
+                continue
+            mac = node['mac'].lower()
+            current_node = results['nodes'][mac]
+            try:
+                ifaces = interface_planner.apply(node, node_interfaces[mac],
+                                                 layout)
+            except interface_layout.LayoutError as e:
+                raise EnvError('%s: %s' % (node_label(current_node), e))
+            if ifaces is not None:
+                plans['interfaces'].add(
+                    'update interfaces of', node_label(current_node),
+                    plan.diff(node_interfaces[mac], ifaces))
+                interfaces[current_node['id']] = ifaces
+        LOG.debug('Interface assignments computed %s time(s), reused %s '
+                  'time(s), %s node(s) unchanged',
+                  interface_planner.stats['planned'],
+                  interface_planner.stats['reused'],
+                  interface_planner.stats['unchanged'])
+        if not dry_run:
+            map_nodes(
+                lambda node_id: client.put_node_interfaces(
+                    node_id, interfaces[node_id]),
+                interfaces, concurrency)
+
+    @for_cluster
+    def deploy(cluster_id, results):
+        status = results['cluster'].get('status')
+        # Changes made by the build resumed are not deployed yet either.
+        resumed_changes = any(build_journal.records[step].get('changed')
+                              for step in skipped)
+        changed = any(plans.values()) or resumed_changes
+        if cluster_id in under_way or (
+                not changed and status not in REDEPLOY_STATUSES):
+            return
+        plans['deploy'].add('deploy cluster', cluster_id,
+                            [(('status',), status, 'operational')])
+        if not dry_run:
+            client.deploy_cluster_changes(cluster_id)
+
+    funcs = {
+        'nodes': fetch_nodes,
+        'node disks': fetch_disks,
+        'node interfaces': fetch_interfaces,
+        'validate': validate,
+        'cluster': find_cluster,
+        'attributes': update_attributes,
+        'networks': update_networks,
+        'roles': assign_roles,
+        'names': rename_nodes,
+        'disks': put_disks,
+        'interfaces': put_interfaces,
+        'deploy': deploy,
+    }
+    env_steps = steps.Steps()
+    for name, requires in ENV_STEPS:
+        func = funcs[name]
+        if name in digests:
+            func = journaled(name, func)
+        env_steps.add(name, func, requires)
+    try:
+        results, timings = env_steps.run()
+    except steps.StepError as e:
+        LOG.info('Steps of environment %s until %s failed:\n%s',
+                 settings['env_name'], e.step, e.timings.format())
+        raise e.exc_info[0], e.exc_info[1], e.exc_info[2]
+    LOG.info('Steps of environment %s:\n%s', settings['env_name'],
+             timings.format())
+
+    changes = plan.Plan()
+    for name, _ in ENV_STEPS:
+        for entry in plans[name].entries:
+            changes.add(*entry)
+    cluster = results['cluster']
+    return (cluster['id'] if cluster is not None else None, changes,
+            timings)
+
+
+def client_key(settings):
+    return (settings['master_ip'], settings['username'],
+            settings['password'], settings['tenant_name'])
+
+
+def connect(jobs, client_options=None, clients=None):
+    """Return a {client_key: NailgunClient} dict covering all the jobs.
+
+    Clients already in `clients` are reused, the missing ones are created
+    with client_options and authenticated.
+    """
+    clients = {} if clients is None else clients
+    for settings in jobs.values():
+        key = client_key(settings)
+        if key not in clients:
+            clients[key] = nailgun_client.NailgunClient(
+                *key, **(client_options or {}))
+            clients[key].client.authenticate()
+    return clients
+
+
+def build_envs(jobs, concurrency=1, parallel_envs=1, dry_run=False,
+               client_options=None, clients=None, build_journal=True,
+               resume=False):
+    """Build environments from a {settings file: settings} dict.
+
+    Environments managed by the same master and user share one client,
+    created with client_options and authenticated once up front, or
+    taken from `clients` (see connect()). Each build is recorded in the
+    journal of its environment (see build_env()) unless build_journal is
+    false. Returns a {settings file: result} dict, a result holding the
+    environment name, cluster ID, plan of changes, step timings,
+    duration and error.
+    """
+    clients = connect(jobs, client_options, clients)
+
+    def build(path):
+        settings = jobs[path]
+        client = clients[client_key(settings)]
+        result = {'env_name': settings['env_name'], 'cluster_id': None,
+                  'plan': None, 'timings': None, 'error': None}
+        started = time.time()
+        try:
+            (result['cluster_id'], result['plan'],
+             result['timings']) = build_env(
+                client, settings, concurrency, dry_run,
+                journal.Journal.for_env(settings) if build_journal else None,
+                resume)
+        except Exception as e:
+            LOG.exception('Failed to build environment %s from %s',
+                          settings['env_name'], path)
+            result['error'] = str(e) or repr(e)
+        result['duration'] = time.time() - started
+        return result
+
+    return parallel.map_keys(build, sorted(jobs), parallel_envs)
+
+
+def print_summary(results, stream=sys.stdout):
+    stream.write('%-30s %-10s %10s  %s\n' % (
+        'ENVIRONMENT', 'CLUSTER', 'TIME', 'RESULT'))
+    for path in sorted(results):
+        result = results[path]
+        stream.write('%-30s %-10s %9.1fs  %s\n' % (
+            result['env_name'], result['cluster_id'] or '-',
+            result['duration'], result['error'] or 'ok'))
+
+
+def load_jobs(paths):
+    """Load the settings files found in `paths` as build_envs() jobs."""
+    files = find_settings_files(paths)
+    if not files:
+        raise EnvError('No settings files found in %s' % ', '.join(paths))
+    jobs = {}
+    for path in files:
+        jobs[path] = load_settings(path)
+        LOG.info('Used settings: %s', jobs[path])
+    return jobs
+
+
+def report(results, dry_run=False, stream=sys.stdout, timings=False):
+    """Write the plans and summary of a run, return its error if any."""
+    if timings:
+        for path in sorted(results):
+            if results[path]['timings'] is not None:
+                stream.write('# %s (%s)\n%s\n' % (
+                    results[path]['env_name'], path,
+                    results[path]['timings'].format()))
+    if dry_run:
+        for path in sorted(results):
+            if results[path]['plan'] is not None:
+                stream.write('# %s (%s)\n%s\n' % (
+                    results[path]['env_name'], path,
+                    results[path]['plan'].format()))
+    if len(results) > 1:
+        print_summary(results, stream)
+    errors = [r['error'] for r in results.values() if r['error']]
+    if len(results) == 1 and errors:
+        return errors[0]
+    if errors:
+        return '%s of %s environment(s) failed' % (len(errors), len(results))
+    return None
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    log_setup(log_file=args.log_file)
+    LOG.info('Start service.')
+    try:
+        jobs = load_jobs(args.settings)
+    except EnvError as e:
+        exit(str(e))
+
+    client_options = {}
+    if args.metrics_json or args.metrics_prom:
+        client_options['metrics'] = metrics.RequestMetrics()
+        client_options['metrics'].export_at_exit(args.metrics_json,
+                                                 args.metrics_prom)
+    results = build_envs(jobs, args.concurrency, args.parallel_envs,
+                         args.plan, client_options, resume=args.resume)
+    error = report(results, args.plan, timings=args.timings)
+    if error:
+        exit(error)
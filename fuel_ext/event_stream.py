@@ -0,0 +1,142 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import json
+import logging
+import os
+import time
+
+from fuel_ext.task_waiter import FINAL_STATUSES
+
+
+LOG = logging.getLogger(__name__)
+
+Event = collections.namedtuple('Event', ['kind', 'data'])
+
+
+class EventStream(object):
+    """New notifications and task changes of a master, as they happen.
+
+    The cursor is the highest notification ID and task ID seen, and the
+    last status and progress of the tasks not finished yet, so each
+    notification and each task change is yielded once and the cursor
+    only grows with the tasks running. Every poll reads both lists whole,
+    the API has no filter for what changed, but streams them, so memory
+    use does not grow with the history of the master. With `cursor_file`
+    the cursor survives restarts; without a cursor the current state is
+    taken as seen unless `history` is set.
+
+    Polling starts every `interval` seconds and slows down by `backoff`
+    up to `max_interval` while nothing happens.
+    """
+
+    def __init__(self, client, cursor_file=None, history=False, interval=1,
+                 max_interval=30, backoff=2):
+        self.client = client
+        self.cursor_file = cursor_file
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.cursor = self._load()
+        if self.cursor is None:
+            self.cursor = {'notification_id': 0, 'task_id': 0, 'tasks': {}}
+            if not history:
+                self.poll()
+
+    def _load(self):
+        if self.cursor_file is None:
+            return None
+        try:
+            with open(self.cursor_file) as f:
+                cursor = json.load(f)
+            tasks = dict(cursor['tasks'])
+            if 'task_id' not in cursor:
+                # Written when every task was kept, finished ones included.
+                cursor['task_id'] = max([int(t) for t in tasks] or [0])
+                tasks = dict((t, state) for t, state in tasks.items()
+                             if state[0] not in FINAL_STATUSES)
+            return {'notification_id': int(cursor['notification_id']),
+                    'task_id': int(cursor['task_id']), 'tasks': tasks}
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save(self):
+        if self.cursor_file is None:
+            return
+        tmp_path = '{0}.{1}.tmp'.format(self.cursor_file, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.cursor, f)
+            os.rename(tmp_path, self.cursor_file)
+        except (IOError, OSError) as e:
+            LOG.warning('Can not save event cursor to %s: %s',
+                        self.cursor_file, e)
+
+    def poll(self):
+        """Return the events since the last poll and move the cursor."""
+        events = []
+        last_id = self.cursor['notification_id']
+        for notification in self.client.iter_notifications():
+            if notification['id'] > self.cursor['notification_id']:
+                events.append(Event('notification', notification))
+                last_id = max(last_id, notification['id'])
+        events.sort(key=lambda e: e.data['id'])
+
+        last_task_id = self.cursor['task_id']
+        running = self.cursor['tasks']
+        tasks = {}
+        for task in self.client.iter_tasks():
+            # JSON object keys are strings, the cursor may come from a file.
+            task_id = str(task['id'])
+            state = [task.get('status'), task.get('progress')]
+            if task['id'] > self.cursor['task_id']:
+                events.append(Event('task', task))
+                last_task_id = max(last_task_id, task['id'])
+            elif task_id not in running:
+                # Finished when last seen.
+                continue
+            elif running[task_id] != state:
+                events.append(Event('task', task))
+            if state[0] not in FINAL_STATUSES:
+                tasks[task_id] = state
+
+        # Tasks finished or gone from the master are dropped from the
+        # cursor.
+        self.cursor = {'notification_id': last_id, 'task_id': last_task_id,
+                       'tasks': tasks}
+        self._save()
+        return events
+
+    def __iter__(self):
+        return self.events()
+
+    def events(self, timeout=None):
+        """Yield events as they happen, for `timeout` seconds if given."""
+        deadline = None if timeout is None else time.time() + timeout
+        interval = self.interval
+        while True:
+            events = self.poll()
+            for event in events:
+                yield event
+            if events:
+                interval = self.interval
+            else:
+                interval = min(interval * self.backoff, self.max_interval)
+            if deadline is not None:
+                left = deadline - time.time()
+                if left <= 0:
+                    return
+                interval = min(interval, left)
+            time.sleep(interval)
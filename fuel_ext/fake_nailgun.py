@@ -0,0 +1,624 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In-process fake of the Nailgun, OSTF and Keystone v2 APIs.
+
+It models clusters, nodes with their disks and interfaces, network
+configuration, deployment tasks and OSTF runs closely enough to run
+`fuel-env` and NailgunClient against it. Both APIs are served on one
+port, so a client is pointed to it with:
+
+    fake = FakeNailgun(nodes=100).start()
+    client = NailgunClient('127.0.0.1', 'admin', 'admin', 'admin',
+                           port=fake.port, keystone_port=fake.port)
+
+Latency can be added per endpoint template, e.g.
+{'GET /api/nodes/{id}/disks': 0.02, '*': 0.005}.
+"""
+
+import argparse
+import BaseHTTPServer
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import re
+import SocketServer
+import threading
+import time
+import urlparse
+import uuid
+
+from fuel_ext.metrics import endpoint_template
+
+
+LOG = logging.getLogger(__name__)
+
+NETWORK_NAMES = ('public', 'management', 'storage', 'private')
+ADMIN_NETWORK = {'id': 1, 'name': 'fuelweb_admin'}
+VOLUMES = ('os', 'image', 'vm', 'cinder', 'ceph', 'mysql', 'mongo')
+DEPLOYMENT_TASKS = (
+    {'id': 'hiera', 'type': 'puppet', 'role': '*',
+     'requires': [], 'required_for': ['globals']},
+    {'id': 'globals', 'type': 'puppet', 'role': '*',
+     'requires': ['hiera'], 'required_for': ['netconfig']},
+    {'id': 'netconfig', 'type': 'puppet', 'role': '*',
+     'requires': ['globals'], 'required_for': ['deploy_end']},
+    {'id': 'database', 'type': 'puppet', 'role': ['controller'],
+     'requires': ['netconfig'], 'required_for': ['keystone']},
+    {'id': 'keystone', 'type': 'puppet', 'role': ['controller'],
+     'requires': ['database'], 'required_for': ['deploy_end']},
+    {'id': 'nova-compute', 'type': 'puppet', 'role': ['compute'],
+     'requires': ['netconfig'], 'required_for': ['deploy_end']},
+    {'id': 'deploy_end', 'type': 'stage', 'requires': [],
+     'required_for': []},
+)
+OSTF_TESTS = (
+    ('sanity', 'fuel_health.tests.sanity.test_compute.ComputeTest'),
+    ('sanity', 'fuel_health.tests.sanity.test_identity.IdentityTest'),
+    ('smoke', 'fuel_health.tests.smoke.test_create_flavor.FlavorsTest'),
+    ('smoke', 'fuel_health.tests.smoke.test_create_volume.VolumesTest'),
+    ('ha', 'fuel_health.tests.ha.test_mysql_replication.MysqlTest'),
+)
+
+
+def _mac(index):
+    return '52:54:00:{0:02x}:{1:02x}:{2:02x}'.format(
+        (index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff)
+
+
+class NotFound(Exception):
+    pass
+
+
+class FakeState(object):
+    """Data and behaviour of the fake master, guarded by one lock."""
+
+    def __init__(self, nodes=10, deploy_time=1.0, ostf_time=0.5,
+                 token_ttl=3600, username='admin', password='admin'):
+        self.lock = threading.RLock()
+        self.deploy_time = deploy_time
+        self.ostf_time = ostf_time
+        self.token_ttl = token_ttl
+        self.credentials = (username, password)
+        self.tokens = {}
+        self.clusters = {}
+        self.attributes = {}
+        self.networks = {}
+        self.tasks = []
+        self.notifications = []
+        self.ostf_runs = {}
+        self.nodes = {}
+        self.disks = {}
+        self.interfaces = {}
+        self.releases = [{'id': 2, 'name': 'Juno on Ubuntu 14.04.1',
+                          'operating_system': 'Ubuntu',
+                          'version': '2014.2.2-6.1', 'state': 'available'}]
+        for index in range(1, nodes + 1):
+            self.add_node(index)
+
+    def add_node(self, index):
+        mac = _mac(index)
+        self.nodes[index] = {
+            'id': index, 'mac': mac, 'name': 'Untitled ({0})'.format(
+                mac[-5:].replace(':', '')),
+            'status': 'discover', 'online': True, 'cluster': None,
+            'roles': [], 'pending_roles': [], 'pending_addition': False,
+            'ip': '10.20.{0}.{1}'.format(index // 250, index % 250 + 2),
+            'manufacturer': 'KVM', 'platform_name': None,
+            'meta': {
+                'cpu': {'total': 8, 'real': 2, 'spec': [
+                    {'model': 'Intel(R) Xeon(R) CPU E5-2680 v2',
+                     'frequency': 2800}] * 8},
+                'memory': {'total': 68719476736},
+                'disks': [{'name': name, 'size': size,
+                           'disk': 'disk/by-path/pci-0000:00:{0:02x}.0'
+                           .format(i), 'model': 'QEMU HARDDISK'}
+                          for i, (name, size) in enumerate(
+                              (('sda', 500107862016),
+                               ('sdb', 1000204886016)))],
+                'interfaces': [{'name': 'eth{0}'.format(i),
+                                'mac': _mac(index * 4 + i),
+                                'max_speed': 10000, 'current_speed': 10000}
+                               for i in range(3)],
+            },
+        }
+        self.disks[index] = [
+            {'id': disk['disk'], 'name': disk['name'],
+             'size': disk['size'] // (1024 * 1024),
+             'volumes': [{'name': volume, 'size': 0} for volume in VOLUMES],
+             'extra': []}
+            for disk in self.nodes[index]['meta']['disks']]
+        self.interfaces[index] = [
+            {'id': index * 4 + i, 'name': iface['name'], 'mac': iface['mac'],
+             'type': 'ether', 'state': 'up',
+             'max_speed': iface['max_speed'],
+             'current_speed': iface['current_speed'],
+             'assigned_networks': [dict(ADMIN_NETWORK)] if i == 0 else []}
+            for i, iface in enumerate(self.nodes[index]['meta']['interfaces'])]
+
+    # Keystone
+
+    def issue_token(self, body):
+        auth = body.get('auth', {})
+        creds = auth.get('passwordCredentials')
+        if creds is None:
+            # Rescoping an existing token.
+            if not self.valid_token(auth.get('token', {}).get('id')):
+                raise NotFound()
+            creds = {'username': self.credentials[0]}
+        elif (creds.get('username'),
+              creds.get('password')) != self.credentials:
+            raise NotFound()
+        token = uuid.uuid4().hex
+        expires = time.time() + self.token_ttl
+        with self.lock:
+            self.tokens[token] = expires
+        expires_at = datetime.datetime.utcfromtimestamp(expires)
+        tenant = {'id': 'admin-tenant',
+                  'name': auth.get('tenantName', 'admin'), 'enabled': True}
+        return {'access': {
+            'token': {'id': token, 'tenant': tenant,
+                      'issued_at': datetime.datetime.utcnow().isoformat(),
+                      'expires': expires_at.strftime('%Y-%m-%dT%H:%M:%SZ')},
+            'serviceCatalog': [],
+            'user': {'id': 'admin-user', 'name': creds['username'],
+                     'username': creds['username'],
+                     'roles': [{'name': 'admin'}]},
+            'metadata': {'is_admin': 0, 'roles': []}}}
+
+    def valid_token(self, token):
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    # Clusters
+
+    def get_cluster(self, cluster_id):
+        try:
+            return self.clusters[cluster_id]
+        except KeyError:
+            raise NotFound()
+
+    def create_cluster(self, data):
+        if any(c['name'] == data.get('name')
+               for c in self.clusters.values()):
+            raise ValueError('Environment with this name already exists.')
+        cluster_id = max(self.clusters or [0]) + 1
+        cluster = {'id': cluster_id, 'name': data['name'],
+                   'release_id': data.get('release_id', 2),
+                   'net_provider': data.get('net_provider', 'neutron'),
+                   'net_segment_type': data.get('net_segment_type', 'vlan'),
+                   'mode': 'ha_compact', 'status': 'new',
+                   'is_customized': False, 'changes': []}
+        self.clusters[cluster_id] = cluster
+        self.attributes[cluster_id] = {'editable': {
+            'gamma-lcp-ui': {'metadata': {'enabled': False}},
+            'common': {'libvirt_type': {'value': 'qemu'},
+                       'debug': {'value': False}},
+            'public_network_assignment': {
+                'assign_to_all_nodes': {'value': False}},
+            'repo_setup': {'repos': {'value': []}},
+            'syslog': {'syslog_server': {'value': ''},
+                       'syslog_port': {'value': '514'}},
+        }}
+        base = cluster_id * 10
+        self.networks[cluster_id] = {
+            'networks': [
+                {'id': base + i, 'name': name, 'group_id': cluster_id,
+                 'cidr': '192.168.{0}.0/24'.format(i), 'gateway': None,
+                 'vlan_start': 100 + i, 'ip_ranges': [],
+                 'meta': {'notation': 'cidr'}}
+                for i, name in enumerate(NETWORK_NAMES)] + [
+                dict(ADMIN_NETWORK, cidr='10.20.0.0/16', vlan_start=None,
+                     ip_ranges=[['10.20.0.3', '10.20.255.254']])],
+            'networking_parameters': {
+                'floating_ranges': [['172.16.0.130', '172.16.0.254']],
+                'vlan_range': [1000, 1030], 'base_mac': 'fa:16:3e:00:00:00',
+                'internal_cidr': '192.168.111.0/24',
+                'fixed_networks_vlan_start': 103,
+                'fixed_networks_amount': 1},
+        }
+        return cluster
+
+    def delete_cluster(self, cluster_id):
+        self.get_cluster(cluster_id)
+        for node in self.nodes.values():
+            if node['cluster'] == cluster_id:
+                node.update(cluster=None, roles=[], pending_roles=[],
+                            status='discover')
+        for store in (self.clusters, self.attributes, self.networks):
+            store.pop(cluster_id, None)
+
+    def assign(self, cluster_id, data):
+        self.get_cluster(cluster_id)
+        for item in data:
+            node = self.nodes[item['id']]
+            node.update(cluster=cluster_id, pending_roles=item['roles'],
+                        pending_addition=True)
+
+    def cluster_nodes(self, cluster_id):
+        return [n for n in self.nodes.values() if n['cluster'] == cluster_id]
+
+    # Tasks
+
+    def add_task(self, cluster_id, name, duration):
+        task = {'id': len(self.tasks) + 1, 'name': name,
+                'cluster': cluster_id, 'status': 'running', 'progress': 0,
+                'message': None, 'uuid': uuid.uuid4().hex,
+                'started': time.time(), 'duration': duration}
+        self.tasks.append(task)
+        return task
+
+    def refresh_tasks(self):
+        now = time.time()
+        for task in self.tasks:
+            if task['status'] != 'running':
+                continue
+            done = (now - task['started']) / (task['duration'] or 1e-9)
+            task['progress'] = min(100, int(done * 100))
+            if task['progress'] < 100:
+                continue
+            task['status'] = 'ready'
+            cluster = self.clusters.get(task['cluster'])
+            if task['name'] == 'deploy' and cluster is not None:
+                cluster['status'] = 'operational'
+                for node in self.cluster_nodes(cluster['id']):
+                    node.update(roles=node['pending_roles'] or node['roles'],
+                                pending_roles=[], pending_addition=False,
+                                status='ready')
+            self.notifications.append({
+                'id': len(self.notifications) + 1, 'topic': 'done',
+                'status': 'unread', 'cluster': task['cluster'],
+                'message': 'Task {0} is done'.format(task['name']),
+                'time': time.strftime('%H:%M:%S')})
+
+    def public_task(self, task):
+        return dict((k, v) for k, v in task.items()
+                    if k not in ('started', 'duration'))
+
+    def deploy(self, cluster_id):
+        cluster = self.get_cluster(cluster_id)
+        cluster['status'] = 'deployment'
+        return self.add_task(cluster_id, 'deploy', self.deploy_time)
+
+    # OSTF
+
+    def ostf_tests(self, cluster_id):
+        return [{'id': test_id, 'testset': testset,
+                 'name': test_id.rsplit('.', 1)[-1], 'status': None,
+                 'taken': None, 'message': None}
+                for testset, test_id in OSTF_TESTS]
+
+    def ostf_start(self, data):
+        runs = []
+        for item in data:
+            cluster_id = int(item['metadata']['cluster_id'])
+            tests = [t for t in self.ostf_tests(cluster_id)
+                     if t['testset'] == item['testset'] and
+                     ('tests' not in item or t['id'] in item['tests'])]
+            run = {'id': sum(len(r) for r in self.ostf_runs.values()) + 1,
+                   'testset': item['testset'], 'cluster_id': cluster_id,
+                   'status': 'running', 'started_at': time.time(),
+                   'tests': tests}
+            self.ostf_runs.setdefault(cluster_id, {})[item['testset']] = run
+            runs.append(self.public_run(run))
+        return runs
+
+    def public_run(self, run):
+        elapsed = time.time() - run['started_at']
+        finished = elapsed >= self.ostf_time
+        run = dict(run, tests=[dict(t) for t in run['tests']])
+        run['status'] = 'finished' if finished else 'running'
+        for index, test in enumerate(run['tests']):
+            test['taken'] = round(self.ostf_time / (index + 1), 3)
+            test['status'] = 'success' if finished else 'running'
+        return run
+
+
+class FakeNailgun(object):
+    """Fake master serving the Nailgun, OSTF and Keystone APIs."""
+
+    def __init__(self, nodes=10, latency=None, host='127.0.0.1', port=0,
+                 **state_options):
+        self.state = FakeState(nodes=nodes, **state_options)
+        self.latency = dict(latency or {})
+        self.stats = collections.Counter()
+        self._stats_lock = threading.Lock()
+        self._routes = self._build_routes()
+        self.server = _Server((host, port), _Handler)
+        self.server.fake = self
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server.server_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name='fake-nailgun')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def delay(self, key):
+        seconds = self.latency.get(key, self.latency.get('*', 0))
+        if seconds:
+            time.sleep(seconds)
+
+    def _build_routes(self):
+        s = self.state
+        routes = [
+            ('GET', r'/api/version', lambda m, b, q: {'release': '6.1'}),
+            ('GET', r'/api/releases/?', lambda m, b, q: s.releases),
+            ('GET', r'/api/releases/(\d+)/?', self._release),
+            ('GET', r'/api/releases/(\d+)/deployment_tasks',
+             lambda m, b, q: list(DEPLOYMENT_TASKS)),
+            ('GET', r'/api/clusters/?',
+             lambda m, b, q: s.clusters.values()),
+            ('POST', r'/api/clusters/?', self._create_cluster),
+            ('GET', r'/api/clusters/(\d+)/?',
+             lambda m, b, q: s.get_cluster(int(m[0]))),
+            ('PUT', r'/api/clusters/(\d+)/?', self._update_cluster),
+            ('DELETE', r'/api/clusters/(\d+)/?',
+             lambda m, b, q: s.delete_cluster(int(m[0]))),
+            ('GET', r'/api/clusters/(\d+)/attributes/?',
+             lambda m, b, q: s.attributes[s.get_cluster(int(m[0]))['id']]),
+            ('PUT', r'/api/clusters/(\d+)/attributes/?', self._put_attrs),
+            ('GET', r'/api/clusters/(\d+)/network_configuration/\w+/?',
+             lambda m, b, q: s.networks[s.get_cluster(int(m[0]))['id']]),
+            ('PUT', r'/api/clusters/(\d+)/network_configuration/\w+/?',
+             self._put_networks),
+            ('PUT', r'/api/clusters/(\d+)/network_configuration/\w+/verify/',
+             lambda m, b, q: s.public_task(s.add_task(
+                 int(m[0]), 'verify_networks', s.deploy_time / 10))),
+            ('POST', r'/api/v1/clusters/(\d+)/assignment',
+             lambda m, b, q: s.assign(int(m[0]), b)),
+            ('PUT', r'/api/clusters/(\d+)/changes/?',
+             lambda m, b, q: s.public_task(s.deploy(int(m[0])))),
+            ('PUT', r'/api/clusters/(\d+)/(provision|deploy)/?',
+             lambda m, b, q: s.public_task(s.add_task(
+                 int(m[0]), m[1], s.deploy_time))),
+            ('PUT', r'/api/clusters/(\d+)/(stop_deployment|reset|update)/',
+             lambda m, b, q: s.public_task(s.add_task(
+                 int(m[0]), m[1], s.deploy_time / 10))),
+            ('GET', r'/api/clusters/(\d+)/deployment_tasks',
+             lambda m, b, q: list(DEPLOYMENT_TASKS)),
+            ('GET', r'/api/clusters/(\d+)/orchestrator/deployment',
+             self._deployment_info),
+            ('GET', r'/api/nodes/?', self._list_nodes),
+            ('PUT', r'/api/nodes/?', self._update_nodes),
+            ('GET', r'/api/nodes/(\d+)/?', self._node),
+            ('PUT', r'/api/nodes/(\d+)/?', self._update_node),
+            ('GET', r'/api/nodes/(\d+)/disks',
+             lambda m, b, q: s.disks[self._node(m, b, q)['id']]),
+            ('PUT', r'/api/nodes/(\d+)/disks', self._put_disks),
+            ('GET', r'/api/nodes/(\d+)/interfaces',
+             lambda m, b, q: s.interfaces[self._node(m, b, q)['id']]),
+            ('PUT', r'/api/nodes/(\d+)/interfaces', self._put_interfaces),
+            ('GET', r'/api/tasks/?',
+             lambda m, b, q: [s.public_task(t) for t in s.tasks]),
+            ('GET', r'/api/tasks/(\d+)/?', self._task),
+            ('GET', r'/api/notifications/?',
+             lambda m, b, q: s.notifications),
+            ('GET', r'/ostf/testsets/(\d+)',
+             lambda m, b, q: [{'id': t, 'name': t}
+                              for t in sorted(set(
+                                  ts for ts, _ in OSTF_TESTS))]),
+            ('GET', r'/ostf/tests/(\d+)',
+             lambda m, b, q: s.ostf_tests(int(m[0]))),
+            ('POST', r'/ostf/testruns', lambda m, b, q: s.ostf_start(b)),
+            ('GET', r'/ostf/testruns/last/(\d+)',
+             lambda m, b, q: [s.public_run(r) for r in s.ostf_runs.get(
+                 int(m[0]), {}).values()]),
+        ]
+        return [(method, re.compile('^' + pattern + '$'), func)
+                for method, pattern, func in routes]
+
+    def dispatch(self, method, path, body):
+        parsed = urlparse.urlparse(path)
+        query = urlparse.parse_qs(parsed.query)
+        for route_method, pattern, func in self._routes:
+            match = pattern.match(parsed.path)
+            if route_method == method and match:
+                with self.state.lock:
+                    self.state.refresh_tasks()
+                    return func(match.groups(), body, query)
+        raise NotFound()
+
+    def _release(self, m, b, q):
+        for release in self.state.releases:
+            if release['id'] == int(m[0]):
+                return release
+        raise NotFound()
+
+    def _create_cluster(self, m, b, q):
+        return self.state.create_cluster(b)
+
+    def _update_cluster(self, m, b, q):
+        cluster = self.state.get_cluster(int(m[0]))
+        cluster.update((k, v) for k, v in b.items() if k != 'id')
+        return cluster
+
+    def _put_attrs(self, m, b, q):
+        cluster_id = self.state.get_cluster(int(m[0]))['id']
+        self.state.attributes[cluster_id] = b
+        return b
+
+    def _put_networks(self, m, b, q):
+        cluster_id = self.state.get_cluster(int(m[0]))['id']
+        self.state.networks[cluster_id] = b
+        return self.state.public_task(self.state.add_task(
+            cluster_id, 'check_networks', 0))
+
+    def _deployment_info(self, m, b, q):
+        cluster = self.state.get_cluster(int(m[0]))
+        info = []
+        for node in sorted(self.state.cluster_nodes(cluster['id']),
+                           key=lambda n: n['id']):
+            for role in node['roles'] or node['pending_roles']:
+                info.append({
+                    'uid': str(node['id']), 'role': role,
+                    'fqdn': 'node-{0}.domain.tld'.format(node['id']),
+                    'deployment_id': cluster['id'],
+                    'network_scheme': {'interfaces': dict(
+                        (i['name'], {}) for i in
+                        self.state.interfaces[node['id']])},
+                    'nodes': [{'uid': str(n['id']), 'role': r,
+                               'name': 'node-{0}'.format(n['id'])}
+                              for n in self.state.cluster_nodes(
+                                  cluster['id'])
+                              for r in n['roles'] or n['pending_roles']],
+                })
+        return info
+
+    def _list_nodes(self, m, b, q):
+        nodes = sorted(self.state.nodes.values(), key=lambda n: n['id'])
+        if 'cluster_id' in q:
+            cluster_id = int(q['cluster_id'][0])
+            nodes = [n for n in nodes if n['cluster'] == cluster_id]
+        return nodes
+
+    def _node(self, m, b, q):
+        try:
+            return self.state.nodes[int(m[0])]
+        except KeyError:
+            raise NotFound()
+
+    def _update_node(self, m, b, q):
+        node = self._node(m, b, q)
+        node.update((k, v) for k, v in b.items() if k != 'id')
+        return node
+
+    def _update_nodes(self, m, b, q):
+        return [self._update_node([item['id']], item, q) for item in b]
+
+    def _put_disks(self, m, b, q):
+        self.state.disks[self._node(m, b, q)['id']] = b
+        return b
+
+    def _put_interfaces(self, m, b, q):
+        self.state.interfaces[self._node(m, b, q)['id']] = b
+        return b
+
+    def _task(self, m, b, q):
+        for task in self.state.tasks:
+            if task['id'] == int(m[0]):
+                return self.state.public_task(task)
+        raise NotFound()
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Write each response in one go, small writes on a keep-alive
+    # connection stall on delayed ACKs.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        LOG.debug(format, *args)
+
+    def _respond(self, code, payload):
+        self._send(code, json.dumps(payload))
+
+    def _send(self, code, body):
+        etag = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+        if code == 200 and self.headers.get('If-None-Match') == etag:
+            code, body = 304, ''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if code in (200, 304):
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def _handle(self):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else ''
+        key = '{0} {1}'.format(self.command, endpoint_template(self.path))
+        fake.count(key)
+        fake.delay(key)
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            return self._respond(400, {'message': 'Invalid JSON'})
+
+        if self.path.startswith('/v2.0/tokens'):
+            try:
+                return self._respond(200, fake.state.issue_token(body))
+            except (NotFound, KeyError, AttributeError):
+                return self._respond(401, {'error': {
+                    'message': 'Invalid credentials', 'code': 401}})
+        if not fake.state.valid_token(self.headers.get('X-Auth-Token')):
+            return self._respond(401, {'message': 'Unauthorized'})
+        try:
+            payload = fake.dispatch(self.command, self.path, body)
+        except NotFound:
+            return self._respond(404, {'message': 'Not found'})
+        except ValueError as e:
+            return self._respond(409, {'message': str(e)})
+        code = 201 if self.command == 'POST' else 200
+        with fake.state.lock:
+            # Serialize under the lock, handlers return live objects.
+            body = json.dumps(payload)
+        self._send(code, body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='fuel-fake-nailgun')
+    parser.add_argument('--nodes', type=int, default=10)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every request')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    fake = FakeNailgun(nodes=args.nodes, host=args.host, port=args.port,
+                       latency={'*': args.latency})
+    LOG.info('Fake Nailgun with %s nodes listening on %s',
+             args.nodes, fake.url)
+    fake.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -14,99 +14,245 @@
 
 import json
 import logging
+import socket
+import time
 import urllib2
 
-from keystoneclient.v2_0 import Client as keystoneclient
-from keystoneclient import exceptions
+from fuel_ext.compression import CompressionHandler
+from fuel_ext.connection_pool import ConnectionPool
+from fuel_ext.connection_pool import KeepAliveHandler
+from fuel_ext.http_cache import ResponseCache
+from fuel_ext.limiter import AdaptiveLimiter
+from fuel_ext.limiter import backoff_delay
+from fuel_ext.limiter import OVERLOAD_STATUSES
+from fuel_ext import token_manager
+from fuel_ext.token_manager import TokenManager
 
 
 LOG = logging.getLogger(__name__)
 
+# Requests retried on an overload status or a timeout; a PUT is retried
+# only when its caller marks it idempotent, actions (deploy, stop, verify)
+# are PUTs too and must not be sent twice.
+IDEMPOTENT_METHODS = ('GET',)
+
 
 class HTTPClient(object):
     """HTTPClient."""  # TODO documentation
 
-    def __init__(self, url, keystone_url, credentials, **kwargs):
+    def __init__(self, url, keystone_url, credentials, pool=None,
+                 compress_requests=False, response_cache=True,
+                 metrics=None, limiter=True, retries=3, token_cache=True,
+                 **kwargs):
         LOG.info('Initiate HTTPClient with url %s', url)
         self.url = url
         self.keystone_url = keystone_url
         self.creds = dict(credentials, **kwargs)
-        self.keystone = None
-        self.opener = urllib2.build_opener(urllib2.HTTPHandler)
+        # Tokens are renewed ahead of their expiry and saved for the next
+        # process, pass token_cache=False not to save them.
+        self.tokens = TokenManager(
+            keystone_url, self.creds,
+            token_manager.DEFAULT_DIRECTORY if token_cache else None)
+        # Connections are kept alive and shared between requests (and
+        # threads), a pool can also be shared between several clients.
+        self.pool = pool if pool is not None else ConnectionPool()
+        # Responses are always negotiated as gzip/deflate, large request
+        # bodies are only gzipped on demand as not every server takes them.
+        self.compression = CompressionHandler(
+            compress_requests=compress_requests)
+        self.opener = urllib2.build_opener(KeepAliveHandler(self.pool),
+                                           self.compression)
+        # Reference data (releases, OSTF tests) is cached on disk between
+        # runs, pass response_cache=False to disable it or a ResponseCache
+        # to tune it.
+        if response_cache is True:
+            response_cache = ResponseCache()
+        self.response_cache = response_cache or None
+        # Per-endpoint request statistics, a RequestMetrics when enabled.
+        self.metrics = metrics
+        # Requests in flight are limited adaptively to what the master
+        # sustains, pass limiter=False to disable it or an AdaptiveLimiter
+        # to tune or share it. GETs, and PUTs marked idempotent, failing
+        # with an overload status or a timeout are retried up to `retries`
+        # times.
+        if limiter is True:
+            limiter = AdaptiveLimiter()
+        self.limiter = limiter or None
+        self.retries = retries
+
+    @property
+    def keystone(self):
+        return self.tokens.keystone
 
     def authenticate(self):
-        try:
-            LOG.info('Initialize keystoneclient with url %s',
-                     self.keystone_url)
-            self.keystone = keystoneclient(
-                auth_url=self.keystone_url, **self.creds)
-            # it depends on keystone version, some versions doing auth
-            # explicitly some dont, but we are making it explicitly always
-            self.keystone.authenticate()
-            LOG.debug('Authorization token is successfully updated')
-        except exceptions.AuthorizationFailure:
-            LOG.warning(
-                'Cant establish connection to keystone with url %s',
-                self.keystone_url)
+        """Make sure a valid token is held, authenticating if needed."""
+        return self.tokens.token
 
     @property
     def token(self):
-        if self.keystone is not None:
-            try:
-                return self.keystone.auth_token
-            except exceptions.AuthorizationFailure:
-                LOG.warning(
-                    'Cant establish connection to keystone with url %s',
-                    self.keystone_url)
-            except exceptions.Unauthorized:
-                LOG.warning("Keystone returned unauthorized error, trying "
-                            "to pass authentication.")
-                self.authenticate()
-                return self.keystone.auth_token
-        return None
-
-    def get(self, endpoint):
+        return self.tokens.token
+
+    def get(self, endpoint, use_cache=True):
         req = urllib2.Request(self.url + endpoint)
-        return self._open(req)
+        ttl = None
+        if use_cache and self.response_cache is not None:
+            ttl = self.response_cache.ttl_for(endpoint)
+        if ttl is None:
+            return self._open(req)
+        return self._cached_open(req, ttl)
+
+    def _cached_open(self, req, ttl):
+        cache = self.response_cache
+        url = req.get_full_url()
+        entry = cache.lookup(url)
+        if entry is not None:
+            if time.time() - entry['stored_at'] < ttl:
+                response = cache.response(entry)
+                if response is not None:
+                    cache.stats['hits'] += 1
+                    return response
+            cache.add_validators(req, entry)
+        try:
+            response = self._open(req)
+        except urllib2.HTTPError as e:
+            if e.code != 304 or entry is None:
+                raise
+            e.close()
+            cache.refresh(entry)
+            response = cache.response(entry)
+            if response is None:
+                # The body was evicted meanwhile, fetch it again.
+                return cache.store(url, self._open(urllib2.Request(url)))
+            cache.stats['revalidated'] += 1
+            return response
+        cache.stats['misses'] += 1
+        if response.code != 200:
+            return response
+        return cache.store(url, response)
 
     def post(self, endpoint, data=None, content_type="application/json"):
         if not data:
             data = {}
-        LOG.info('self url is %s' % self.url)
+        LOG.debug('self url is %s', self.url)
         req = urllib2.Request(self.url + endpoint, data=json.dumps(data))
         req.add_header('Content-Type', content_type)
-        return self._open(req)
+        return self._write(req, endpoint)
 
-    def put(self, endpoint, data=None, content_type="application/json"):
+    def put(self, endpoint, data=None, content_type="application/json",
+            idempotent=False):
+        """PUT data, retried like a GET if `idempotent` is true."""
         if not data:
             data = {}
         req = urllib2.Request(self.url + endpoint, data=json.dumps(data))
         req.add_header('Content-Type', content_type)
         req.get_method = lambda: 'PUT'
-        return self._open(req)
+        req.idempotent = idempotent
+        return self._write(req, endpoint)
 
     def delete(self, endpoint):
         req = urllib2.Request(self.url + endpoint)
         req.get_method = lambda: 'DELETE'
-        return self._open(req)
+        return self._write(req, endpoint)
+
+    def _write(self, req, endpoint):
+        # Cached responses of what is written are dropped, whether the
+        # write succeeded or not.
+        try:
+            return self._open(req)
+        finally:
+            if self.response_cache is not None:
+                self.response_cache.invalidate(self.url, endpoint)
 
     def _open(self, req):
+        return self._authorized_open(req)
+
+    def _authorized_open(self, req):
         try:
             return self._get_response(req)
         except urllib2.HTTPError as e:
             if e.code == 401:
-                LOG.warning('Authorization failure: {0}'.format(e.read()))
-                self.authenticate()
+                LOG.warning('Authorization failure: %s', e.read())
+                if self.metrics is not None:
+                    self.metrics.reauth(req.get_method(),
+                                        self._endpoint(req))
+                self.tokens.invalidate(req.get_header('X-auth-token'))
                 return self._get_response(req)
             else:
                 raise
 
+    def _endpoint(self, req):
+        url = req.get_full_url()
+        if url.startswith(self.url):
+            return url[len(self.url):]
+        return req.get_selector()
+
+    def _observe(self, req, status, started, response=None):
+        received = 0
+        if response is not None:
+            # Content-Length is what went over the wire, before decoding.
+            length = response.info().getheader('Content-Length')
+            if length and length.isdigit():
+                received = int(length)
+        self.metrics.observe(req.get_method(), self._endpoint(req), status,
+                             time.time() - started,
+                             len(req.get_data() or ''), received)
+
     def _get_response(self, req):
-        if self.token is not None:
+        token = self.tokens.token
+        if token is not None:
+            req.add_header("X-Auth-Token", token)
+        return self._send(req)
+
+    def _send(self, req):
+        method = req.get_method()
+        retries = 0
+        if method in IDEMPOTENT_METHODS or getattr(req, 'idempotent', False):
+            retries = self.retries
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                token = self.limiter.acquire(self._endpoint(req))
+            overloaded = False
             try:
-                LOG.debug('Set X-Auth-Token to {0}'.format(self.token))
-                req.add_header("X-Auth-Token", self.token)
-            except exceptions.AuthorizationFailure:
-                LOG.warning('Failed with auth in http _get_response')
-                LOG.warning(traceback.format_exc())
-        return self.opener.open(req)
+                return self._attempt(req)
+            except urllib2.HTTPError as e:
+                overloaded = e.code in OVERLOAD_STATUSES
+                if not overloaded or attempt >= retries:
+                    raise
+                reason = e.code
+                retry_after = e.info().getheader('Retry-After', '')
+                e.close()
+            except urllib2.URLError as e:
+                overloaded = isinstance(e.reason, socket.timeout)
+                if not overloaded or attempt >= retries:
+                    raise
+                reason = 'timeout'
+                retry_after = ''
+            finally:
+                if self.limiter is not None:
+                    self.limiter.release(token, overloaded)
+            delay = backoff_delay(attempt)
+            if retry_after.isdigit():
+                delay = max(delay, min(int(retry_after), 60))
+            attempt += 1
+            LOG.warning('%s %s failed with %s, retry %s of %s in %.2fs',
+                        method, req.get_full_url(), reason, attempt,
+                        retries, delay)
+            time.sleep(delay)
+
+    def _attempt(self, req):
+        # Every request sent is observed on its own: the waits for the
+        # limiter and between retries are not part of its latency.
+        if self.metrics is None:
+            return self.opener.open(req)
+        started = time.time()
+        try:
+            response = self.opener.open(req)
+        except urllib2.HTTPError as e:
+            self._observe(req, e.code, started, e)
+            raise
+        except IOError:
+            self._observe(req, 'error', started)
+            raise
+        self._observe(req, response.code, started, response)
+        return response
@@ -0,0 +1,206 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import hashlib
+import httplib
+import json
+import logging
+import os
+import re
+import StringIO
+import threading
+import time
+import urllib2
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.expanduser('~/.cache/fuel_ext/http')
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# Reference data which hardly ever changes: (endpoint regexp, TTL seconds).
+# Within the TTL a cached response is used as is, after it the response is
+# revalidated with a conditional GET. The OSTF tests of a cluster are
+# left out: the server has to be asked for them before each run.
+DEFAULT_TTLS = (
+    (r'^/api/releases/?$', 3600),
+    (r'^/api/releases/\d+/?$', 3600),
+    (r'^/api/releases/\d+/deployment_tasks$', 3600),
+)
+
+
+class ResponseCache(object):
+    """On-disk cache of GET responses, keyed by URL.
+
+    Only endpoints matching one of `ttls` are cached. Entries keep the
+    ETag and Last-Modified validators of the response, so stale entries
+    are revalidated with If-None-Match/If-Modified-Since and refreshed by
+    a 304 without downloading the body again. Once the bodies take more
+    than `max_size` bytes the least recently used entries are removed.
+    Set `bypass` to ignore the cache altogether. Writes through the
+    HTTPClient remove the entries they make stale (see invalidate()).
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_size=DEFAULT_MAX_SIZE,
+                 ttls=DEFAULT_TTLS, bypass=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self.bypass = bypass
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def ttl_for(self, endpoint):
+        """Return the TTL of an endpoint, None if it is not cacheable."""
+        if self.bypass:
+            return None
+        path = endpoint.split('?', 1)[0]
+        for pattern, ttl in self.ttls:
+            if pattern.match(path):
+                return ttl
+        return None
+
+    def _path(self, url, suffix):
+        name = hashlib.sha1(url).hexdigest()
+        return os.path.join(self.directory, name + suffix)
+
+    def lookup(self, url):
+        try:
+            with open(self._path(url, '.json')) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        return entry if entry.get('url') == url else None
+
+    def add_validators(self, req, entry):
+        if entry.get('etag'):
+            req.add_header('If-None-Match', entry['etag'])
+        if entry.get('last_modified'):
+            req.add_header('If-Modified-Since', entry['last_modified'])
+
+    def response(self, entry):
+        """Build an urllib2 response from a cached entry."""
+        try:
+            with open(self._path(entry['url'], '.body'), 'rb') as f:
+                body = f.read()
+        except IOError:
+            return None
+        # Reading refreshes the LRU position of the entry.
+        self._utime(entry['url'])
+        headers = httplib.HTTPMessage(StringIO.StringIO(entry['headers']))
+        response = urllib2.addinfourl(StringIO.StringIO(body), headers,
+                                      entry['url'], 200)
+        response.msg = 'OK'
+        return response
+
+    def refresh(self, entry):
+        """Restart the TTL of an entry revalidated by a 304."""
+        entry['stored_at'] = time.time()
+        self._write(entry['url'], '.json', json.dumps(entry))
+
+    def store(self, url, response):
+        """Store a 200 response and return an equivalent unread one."""
+        body = response.read()
+        response.close()
+        info = response.info()
+        entry = {
+            'url': url,
+            'stored_at': time.time(),
+            'etag': info.getheader('ETag'),
+            'last_modified': info.getheader('Last-Modified'),
+            # Bodies are stored decoded.
+            'headers': ''.join(h for h in info.headers
+                               if not h.lower().startswith(
+                                   ('content-encoding', 'content-length'))),
+            'size': len(body),
+        }
+        if (self._write(url, '.body', body) and
+                self._write(url, '.json', json.dumps(entry))):
+            self.stats['stored'] += 1
+            self._evict()
+        cached = urllib2.addinfourl(StringIO.StringIO(body), info, url,
+                                    response.code)
+        cached.msg = response.msg
+        return cached
+
+    def invalidate(self, base_url, endpoint):
+        """Remove the entries a write to `endpoint` makes stale.
+
+        Those of the endpoint and of the collections above it, e.g.
+        /api/releases/2 and /api/releases/ for a write to
+        /api/releases/2/deployment_tasks.
+        """
+        path = endpoint.split('?', 1)[0].rstrip('/')
+        while path:
+            for candidate in (path, path + '/'):
+                if any(pattern.match(candidate) for pattern, _ in self.ttls):
+                    self._remove(base_url + candidate)
+            path = path.rsplit('/', 1)[0]
+
+    def _remove(self, url):
+        removed = False
+        for suffix in ('.json', '.body'):
+            try:
+                os.remove(self._path(url, suffix))
+                removed = True
+            except OSError:
+                pass
+        if removed:
+            self.stats['invalidated'] += 1
+
+    def _write(self, url, suffix, data):
+        path = self._path(url, suffix)
+        tmp_path = '{0}.{1}.tmp'.format(path, threading.current_thread().ident)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, int('0700', 8))
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            LOG.warning('Can not write to response cache %s: %s',
+                        self.directory, e)
+            return False
+        return True
+
+    def _utime(self, url):
+        try:
+            os.utime(self._path(url, '.body'), None)
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self._lock:
+            try:
+                names = [n for n in os.listdir(self.directory)
+                         if n.endswith('.body')]
+                bodies = []
+                for name in names:
+                    stat = os.stat(os.path.join(self.directory, name))
+                    bodies.append((stat.st_mtime, stat.st_size, name))
+            except OSError:
+                return
+            total = sum(size for _, size, _ in bodies)
+            for _, size, name in sorted(bodies):
+                if total <= self.max_size:
+                    break
+                base = os.path.join(self.directory, name[:-len('.body')])
+                for suffix in ('.json', '.body'):
+                    try:
+                        os.remove(base + suffix)
+                    except OSError:
+                        pass
+                total -= size
+                self.stats['evicted'] += 1
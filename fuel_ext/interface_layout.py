@@ -0,0 +1,152 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Networks of the settings assigned to node interfaces in bulk.
+
+A layout is {interface name: [network names]}. It is given per node
+("interfaces") or per role ("interface_templates"), a node without its
+own layout taking that of its first role which has one:
+
+    "interface_templates": {
+        "compute": {"eth1": ["private", "management", "public"],
+                    "eth2": ["storage"]}}
+
+The admin network goes to the interface named by the "admin_interface"
+setting, or with "pxe" to the interface the node booted from (the one
+with the MAC of the node), when that interface is in the layout; it is
+then taken off the other interfaces.
+
+Nodes with the same interface names, admin interface and layout get the
+same assignments, so they are computed once; nodes already assigned
+those networks are left out.
+"""
+
+import collections
+import copy
+import json
+
+ADMIN_NETWORK = 'fuelweb_admin'
+PXE = 'pxe'
+
+
+class LayoutError(Exception):
+    """Raised when a layout names a network the cluster does not have."""
+
+
+def node_layout(node, templates):
+    """Return the layout of a node from the settings, None if it has none.
+
+    Its own "interfaces", else the template of its first role which has
+    one.
+    """
+    if node.get('interfaces') is not None:
+        return node['interfaces']
+    for role in node.get('roles') or []:
+        if templates.get(role) is not None:
+            return templates[role]
+    return None
+
+
+class NetworkIndex(object):
+    """Networks of a cluster by name, built once per cluster."""
+
+    def __init__(self, networks):
+        self.networks = dict(
+            (n['name'], {'id': n['id'], 'name': n['name']})
+            for n in networks['networks'])
+
+    def assigned(self, names):
+        """Return the assigned_networks of an interface given names."""
+        try:
+            return [self.networks[name] for name in names]
+        except KeyError as e:
+            raise LayoutError('the cluster has no network {0}'.format(e))
+
+
+class InterfacePlanner(object):
+    """Interface assignments for layouts, memoized by NIC fingerprint.
+
+    `stats` counts the assignments computed, reused, and the nodes left
+    out as already assigned.
+    """
+
+    def __init__(self, networks, templates=None, admin_interface='eth0'):
+        self.index = NetworkIndex(networks)
+        self.templates = templates or {}
+        self.admin_interface = admin_interface
+        self.stats = collections.Counter()
+        self._assignments = {}
+
+    def layout_for(self, node):
+        return node_layout(node, self.templates)
+
+    def admin_interface_of(self, node, interfaces):
+        if self.admin_interface != PXE:
+            return self.admin_interface
+        for iface in interfaces:
+            if iface.get('mac', '').lower() == node['mac'].lower():
+                return iface['name']
+        return None
+
+    def assignments(self, names, admin, layout):
+        """Return {interface name: assigned_networks} of a layout.
+
+        Only for the interfaces of the layout among `names`; `admin`
+        also gets the admin network.
+        """
+        key = (names, admin, json.dumps(layout, sort_keys=True))
+        if key in self._assignments:
+            self.stats['reused'] += 1
+            return self._assignments[key]
+        assignments = {}
+        for name in names:
+            if name not in layout:
+                continue
+            networks = list(layout[name])
+            if name == admin:
+                networks.append(ADMIN_NETWORK)
+            assignments[name] = self.index.assigned(networks)
+        self.stats['planned'] += 1
+        self._assignments[key] = assignments
+        return assignments
+
+    def apply(self, node, interfaces, layout):
+        """Return a copy of `interfaces` with the layout assigned.
+
+        `interfaces` are those get_node_interfaces returns. Returns None
+        if they have the networks of the layout already.
+        """
+        names = tuple(sorted(iface['name'] for iface in interfaces))
+        admin = self.admin_interface_of(node, interfaces)
+        assignments = self.assignments(names, admin, layout)
+
+        def desired(iface):
+            if iface['name'] in assignments:
+                return assignments[iface['name']]
+            current = iface.get('assigned_networks') or []
+            if admin in assignments:
+                # The admin network moves to the admin interface.
+                return [n for n in current if n['name'] != ADMIN_NETWORK]
+            return current
+
+        networks = [desired(iface) for iface in interfaces]
+        if all(sorted(n['id'] for n in iface.get('assigned_networks') or [])
+               == sorted(n['id'] for n in assigned)
+               for iface, assigned in zip(interfaces, networks)):
+            self.stats['unchanged'] += 1
+            return None
+        interfaces = copy.deepcopy(interfaces)
+        for iface, assigned in zip(interfaces, networks):
+            iface['assigned_networks'] = copy.deepcopy(assigned)
+        return interfaces
@@ -0,0 +1,103 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.expanduser('~/.cache/fuel_ext/journal')
+
+
+def digest(data):
+    """Return a digest of JSON data, equal for equal data."""
+    return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
+
+
+class Journal(object):
+    """Steps of an environment build done so far, kept in a file.
+
+    Every step done is appended to the file as a JSON line and flushed to
+    disk before the build goes on, with the digest of what the step was
+    given, so a build which failed can be resumed where it stopped: steps
+    recorded with the same digest are not done again. A line torn by a
+    crash is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_env(cls, settings, directory=DEFAULT_DIRECTORY):
+        """Return the journal of the environment of `settings`."""
+        name = re.sub(r'[^\w.-]', '_', '{0}-{1}'.format(
+            settings['master_ip'], settings['env_name']))
+        return cls(os.path.join(directory, name + '.jsonl'))
+
+    def load(self):
+        """Read the steps recorded by the previous builds."""
+        self.records = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        LOG.warning('Ignoring a torn record in %s',
+                                    self.path)
+                        continue
+                    self.records[record['step']] = record
+        except IOError as e:
+            LOG.info('No journal read from %s: %s', self.path, e)
+        return self.records
+
+    def reset(self):
+        """Forget the steps recorded, for a build starting from scratch."""
+        with self._lock:
+            self.records = {}
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def done(self, step, step_digest):
+        """Return the record of `step` if done with the same digest."""
+        record = self.records.get(step)
+        if record is not None and record['digest'] == step_digest:
+            return record
+        return None
+
+    def record(self, step, step_digest, **data):
+        record = dict(data, step=step, digest=step_digest,
+                      at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, int('0700', 8))
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                         int('0600', 8))
+            try:
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.records[step] = record
+        return record
@@ -0,0 +1,114 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import re
+
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Characters a JSON number may go on with.
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+
+def iter_json_array(fp, chunk_size=CHUNK_SIZE):
+    """Decode a JSON array from a file-like object one item at a time.
+
+    Only the item being decoded (plus one chunk) is held in memory, so
+    memory use does not grow with the length of the array. The file is
+    read to the end and closed once the array is exhausted.
+    """
+    decoder = json.JSONDecoder()
+    reader = _Reader(fp, chunk_size)
+    try:
+        if reader.next_char() != '[':
+            raise ValueError('Expected a JSON array')
+        reader.pos += 1
+        if reader.next_char() == ']':
+            return
+        while True:
+            yield reader.decode(decoder)
+            char = reader.next_char()
+            if char == ']':
+                break
+            if char != ',':
+                raise ValueError(
+                    'Expected , or ] at offset {0}'.format(reader.offset))
+            reader.pos += 1
+            reader.next_char()
+        # Drain trailing whitespace so a pooled connection can be reused.
+        while fp.read(chunk_size):
+            pass
+    finally:
+        fp.close()
+
+
+class _Reader(object):
+
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.consumed = 0
+        self.eof = False
+
+    @property
+    def offset(self):
+        return self.consumed + self.pos
+
+    def fill(self, size):
+        """Append at least `size` bytes (less on EOF) to the buffer."""
+        if self.pos > self.chunk_size:
+            self.consumed += self.pos
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        chunks = [self.buf]
+        while size > 0:
+            data = self.fp.read(max(size, self.chunk_size))
+            if not data:
+                self.eof = True
+                break
+            chunks.append(data)
+            size -= len(data)
+        self.buf = ''.join(chunks)
+
+    def next_char(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                raise ValueError('Unexpected end of JSON array')
+            self.fill(self.chunk_size)
+
+    def decode(self, decoder):
+        while True:
+            try:
+                obj, end = decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+            else:
+                # A number or literal at the end of the buffer may continue
+                # in the next chunk, "2." decoding as 2 until the "5"
+                # arrives.
+                if self.eof or (end < len(self.buf) and
+                                self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return obj
+            # Grow geometrically so a large item is re-scanned only a
+            # logarithmic number of times.
+            self.fill(len(self.buf) - self.pos)
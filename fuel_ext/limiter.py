@@ -0,0 +1,105 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import logging
+import random
+import threading
+import time
+
+from fuel_ext.metrics import endpoint_template
+
+
+LOG = logging.getLogger(__name__)
+
+# Statuses telling the master (or the proxy in front of it) is overloaded.
+OVERLOAD_STATUSES = (502, 503, 504)
+
+
+class AdaptiveLimiter(object):
+    """AIMD limit on the number of requests in flight to one master.
+
+    The limit grows by about one per `limit` healthy responses and is
+    multiplied by `backoff` on an overload status, a timeout or a response
+    slower than `tolerance` times (plus `slack` seconds) the fastest one
+    recently seen for the same endpoint. Responses to requests sent before
+    the last cut do not cut it again, so a burst of errors halves the
+    limit only once. A limiter can be shared by clients of the same master.
+    """
+
+    def __init__(self, initial=8, min_limit=1, max_limit=64, backoff=0.5,
+                 tolerance=3.0, slack=0.05, window=200):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.slack = slack
+        self.window = window
+        self.in_flight = 0
+        self.stats = collections.Counter()
+        # endpoint: [baseline, lowest latency of the current window, count]
+        self._latencies = {}
+        self._decreased_at = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, endpoint):
+        """Wait for a free slot, return the token to release it with."""
+        with self._cond:
+            if self.in_flight >= int(self.limit):
+                self.stats['waited'] += 1
+                while self.in_flight >= int(self.limit):
+                    self._cond.wait()
+            self.in_flight += 1
+        return endpoint_template(endpoint), time.time()
+
+    def release(self, token, overloaded=False):
+        endpoint, started = token
+        latency = time.time() - started
+        with self._cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if overloaded or self._slow(endpoint, latency):
+                if started >= self._decreased_at:
+                    self._decrease(latency, overloaded)
+            elif saturated and self.limit < self.max_limit:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+                self.stats['increased'] += 1
+            self._cond.notify_all()
+
+    def _slow(self, endpoint, latency):
+        stats = self._latencies.get(endpoint)
+        if stats is None:
+            stats = self._latencies[endpoint] = [latency, latency, 0]
+        stats[1] = min(stats[1], latency)
+        stats[2] += 1
+        if stats[2] >= self.window:
+            # The baseline follows the master as its idle latency changes.
+            stats[:] = [stats[1], latency, 0]
+        stats[0] = min(stats[0], latency)
+        return latency > stats[0] * self.tolerance + self.slack
+
+    def _decrease(self, latency, overloaded):
+        limit = max(self.limit * self.backoff, self.min_limit)
+        LOG.debug('Concurrency limit %.1f -> %.1f after %s', self.limit,
+                  limit, 'an overload' if overloaded
+                  else 'a {0:.3f}s response'.format(latency))
+        self.limit = limit
+        self._decreased_at = time.time()
+        self.stats['decreased'] += 1
+
+
+def backoff_delay(attempt, base=0.5, cap=10):
+    """Seconds to wait before a retry, exponential with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
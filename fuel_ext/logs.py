@@ -0,0 +1,292 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Logging kept off the threads doing the work.
+
+Loggers get a QueueHandler: a record is put on a bounded queue, and a
+QueueListener thread formats it and writes it out, so logging code never
+waits for a disk or a terminal. Messages are formatted only there, from
+the record arguments (which must not be changed once logged), and only
+if the level is enabled. Records of chatty messages are sampled before
+they are queued. Passwords and tokens are masked by the formatters, and
+the log file is written as JSON lines rotated by size:
+
+    logs.setup(log_file='/var/log/fuel_ext.log')
+"""
+
+import atexit
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import Queue
+import re
+import sys
+import threading
+import time
+
+from fuel_ext import parallel
+
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+MAX_BYTES = 50 * 1024 * 1024
+BACKUP_COUNT = 5
+
+_SECRET_KEYS = r'password|passwd|secret|token|auth_token|x-auth-token'
+# 'password': u'admin', "token": "...", and password=admin.
+_QUOTED_SECRET = re.compile(
+    r'''(['"]?(?:%s)['"]?\s*[:=]\s*u?)(['"])(?:\\.|(?!\2).)*\2'''
+    % _SECRET_KEYS,
+    re.IGNORECASE)
+_BARE_SECRET = re.compile(r'''\b((?:%s)=)[^\s'",&]+''' % _SECRET_KEYS,
+                          re.IGNORECASE)
+# 'password': 12345, "token": null, 'secret': [1, 2] and X-Auth-Token: abc,
+# quoted values being masked already.
+_SCALAR_SECRET = re.compile(
+    r'''(['"]?\b(?:%s)['"]?\s*:\s*)(?!u?['"])(?:\[[^\]]*\]|[^\s,;}\]]+)'''
+    % _SECRET_KEYS, re.IGNORECASE)
+MASK = '***'
+
+
+def redact(text):
+    """Return text with the values of secret keys masked."""
+    text = _QUOTED_SECRET.sub(
+        lambda m: '{0}{1}{2}{1}'.format(m.group(1), m.group(2), MASK), text)
+    text = _SCALAR_SECRET.sub(lambda m: m.group(1) + MASK, text)
+    return _BARE_SECRET.sub(lambda m: m.group(1) + MASK, text)
+
+
+class RedactingFormatter(logging.Formatter):
+    """Text formatter masking secrets."""
+
+    def format(self, record):
+        return redact(logging.Formatter.format(self, record))
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one JSON object, secrets masked."""
+
+    def format(self, record):
+        data = collections.OrderedDict((
+            ('time', self.formatTime(record, TIME_FORMAT)),
+            ('level', record.levelname),
+            ('logger', record.name),
+            ('thread', record.threadName),
+            ('message', redact(record.getMessage())),
+        ))
+        if getattr(record, 'job', None) is not None:
+            data['job'] = record.job
+        if getattr(record, 'suppressed', 0):
+            data['suppressed'] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = redact(record.exc_text)
+        return json.dumps(data)
+
+
+class SamplingFilter(logging.Filter):
+    """Lets at most `limit` records of a message through per `interval`.
+
+    A message is the logger and the format string, whatever the
+    arguments. Records of WARNING and above always pass. The first record
+    let through after others were dropped has their number in its
+    `suppressed` attribute.
+    """
+
+    def __init__(self, limit=100, interval=10, level=logging.WARNING):
+        logging.Filter.__init__(self)
+        self.limit = limit
+        self.interval = interval
+        self.level = level
+        self._windows = {}  # message: [window start, passed, dropped]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        msg = record.msg
+        key = (record.name,
+               msg if isinstance(msg, basestring) else type(msg).__name__)
+        now = time.time()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                dropped = window[2] if window is not None else 0
+                window = self._windows[key] = [now, 0, dropped]
+            if window[1] >= self.limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+            record.suppressed, window[2] = window[2], 0
+        return True
+
+
+class QueueHandler(logging.Handler):
+    """Puts records on a queue for a QueueListener to handle.
+
+    The queue is bounded: records arriving while it is full are counted
+    and dropped rather than waited for.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def emit(self, record):
+        # Set here, the thread-local context is gone in the listener.
+        record.job = getattr(parallel.context, 'job', None)
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+
+class _Sync(object):
+    """Queued to find out when the records queued before are handled."""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class QueueListener(object):
+    """Thread handing the records of a queue over to handlers.
+
+    Handlers can be added and removed while it runs.
+    """
+
+    _STOP = object()
+
+    def __init__(self, queue, handlers, queue_handler=None):
+        self.queue = queue
+        # Replaced, never changed in place: _handle() goes through the
+        # list it got without locking.
+        self.handlers = list(handlers)
+        self.queue_handler = queue_handler
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add_handler(self, handler):
+        with self._lock:
+            self.handlers = self.handlers + [handler]
+
+    def remove_handler(self, handler, timeout=5):
+        """Stop handing records to `handler`, once it got those queued."""
+        self.sync(timeout)
+        with self._lock:
+            self.handlers = [h for h in self.handlers if h is not handler]
+
+    def sync(self, timeout=None):
+        """Wait until the records queued so far are handled."""
+        if self._thread is None:
+            return
+        mark = _Sync()
+        try:
+            self.queue.put(mark, timeout=timeout)
+        except Queue.Full:
+            return
+        mark.done.wait(timeout)
+
+    def _run(self):
+        reported = 0
+        while True:
+            record = self.queue.get()
+            if record is self._STOP:
+                return
+            if isinstance(record, _Sync):
+                record.done.set()
+                continue
+            dropped = getattr(self.queue_handler, 'dropped', 0)
+            if dropped > reported:
+                self._handle(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING,
+                    'levelname': 'WARNING',
+                    'msg': '%s log record(s) dropped, the log queue was '
+                           'full', 'args': (dropped - reported,)}))
+                reported = dropped
+            self._handle(record)
+
+    def _handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self):
+        """Write the records queued so far, then stop the thread."""
+        if self._thread is None:
+            return
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+        for handler in self.handlers:
+            handler.flush()
+
+
+def file_handler(log_file, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+    """Return a JSON lines handler of a file rotated by size.
+
+    None if the file can not be opened, e.g. /var/log is not writable.
+    """
+    try:
+        handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count)
+        os.chmod(log_file, int('0644', 8))
+    except (IOError, OSError) as e:
+        sys.stderr.write('Not logging to {0}: {1}\n'.format(log_file, e))
+        return None
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(JSONFormatter())
+    return handler
+
+
+def setup(log_file=None, level=logging.INFO, console_formatter=None,
+          max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, sample_limit=100,
+          sample_interval=10, queue_size=10000):
+    """Route the records of the root logger through a QueueListener.
+
+    INFO and above go to stderr as text, everything enabled to `log_file`
+    if given as JSON lines. The listener is stopped, and the queue
+    written out, at exit. Returns the listener.
+    """
+    handlers = []
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    console.setFormatter(console_formatter or RedactingFormatter(
+        '%(asctime)s %(levelname)s (%(module)s) %(message)s', TIME_FORMAT))
+    handlers.append(console)
+    if log_file:
+        handler = file_handler(log_file, max_bytes, backup_count)
+        if handler is not None:
+            handlers.append(handler)
+
+    queue = Queue.Queue(queue_size)
+    queue_handler = QueueHandler(queue)
+    if sample_limit:
+        queue_handler.addFilter(SamplingFilter(sample_limit,
+                                               sample_interval))
+    listener = QueueListener(queue, handlers, queue_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    return listener
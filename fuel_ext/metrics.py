@@ -0,0 +1,186 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import atexit
+import bisect
+import collections
+import json
+import logging
+import os
+import re
+import threading
+
+
+LOG = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_ID = re.compile(r'(?<=/)\d+(?=/|$)')
+
+
+def endpoint_template(path):
+    """Return the path without query and with numeric IDs as {id}."""
+    return _ID.sub('{id}', path.split('?', 1)[0])
+
+
+class _EndpointStats(object):
+
+    def __init__(self, buckets):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(buckets) + 1)
+        self.statuses = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.reauths = 0
+
+
+class RequestMetrics(object):
+    """Per-endpoint request statistics of an HTTPClient.
+
+    Requests are grouped by method and endpoint template, IDs in the path
+    being replaced by {id}. Every request sent counts, a retry being a
+    request of its own. For each group the count, latency histogram
+    (time until the response headers are received), status codes, bytes
+    sent and received on the wire and 401-triggered re-authentications
+    are kept. One instance can be shared by several clients.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, method, endpoint):
+        key = (method, endpoint_template(endpoint))
+        stats = self._endpoints.get(key)
+        if stats is None:
+            stats = self._endpoints[key] = _EndpointStats(self.buckets)
+        return stats
+
+    def observe(self, method, endpoint, status, seconds, bytes_sent=0,
+                bytes_received=0):
+        with self._lock:
+            stats = self._stats(method, endpoint)
+            stats.count += 1
+            stats.seconds += seconds
+            stats.buckets[bisect.bisect_left(self.buckets, seconds)] += 1
+            stats.statuses[str(status)] += 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+
+    def reauth(self, method, endpoint):
+        with self._lock:
+            self._stats(method, endpoint).reauths += 1
+
+    def summary(self):
+        """Return the statistics as a JSON-serializable list."""
+        with self._lock:
+            items = sorted(self._endpoints.items())
+            return [{
+                'method': method,
+                'endpoint': endpoint,
+                'count': stats.count,
+                'seconds_total': round(stats.seconds, 6),
+                'seconds_avg': round(stats.seconds / stats.count, 6)
+                if stats.count else None,
+                'histogram': dict(
+                    zip([str(b) for b in self.buckets] + ['+Inf'],
+                        stats.buckets)),
+                'statuses': dict(stats.statuses),
+                'bytes_sent': stats.bytes_sent,
+                'bytes_received': stats.bytes_received,
+                'reauths': stats.reauths,
+            } for (method, endpoint), stats in items]
+
+    def prometheus(self):
+        """Return the statistics in the Prometheus text format."""
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append('# HELP fuel_ext_http_{0} {1}'.format(
+                name, help_text))
+            lines.append('# TYPE fuel_ext_http_{0} {1}'.format(name, kind))
+
+        def sample(name, labels, value):
+            lines.append('fuel_ext_http_{0}{{{1}}} {2}'.format(
+                name, ','.join('{0}="{1}"'.format(k, _label_value(v))
+                               for k, v in labels),
+                value))
+
+        with self._lock:
+            items = sorted(self._endpoints.items())
+            metric('requests_total', 'counter', 'Requests by status.')
+            for (method, endpoint), stats in items:
+                for status, count in sorted(stats.statuses.items()):
+                    sample('requests_total', (('method', method),
+                                              ('endpoint', endpoint),
+                                              ('status', status)), count)
+            metric('request_duration_seconds', 'histogram',
+                   'Time until response headers are received.')
+            for (method, endpoint), stats in items:
+                labels = (('method', method), ('endpoint', endpoint))
+                cumulative = 0
+                bounds = [str(b) for b in self.buckets] + ['+Inf']
+                for bound, count in zip(bounds, stats.buckets):
+                    cumulative += count
+                    sample('request_duration_seconds_bucket',
+                           labels + (('le', bound),), cumulative)
+                sample('request_duration_seconds_sum', labels,
+                       repr(stats.seconds))
+                sample('request_duration_seconds_count', labels, stats.count)
+            for name, attr, help_text in (
+                    ('sent_bytes_total', 'bytes_sent', 'Request bytes.'),
+                    ('received_bytes_total', 'bytes_received',
+                     'Response bytes on the wire.'),
+                    ('reauths_total', 'reauths',
+                     'Re-authentications after a 401.')):
+                metric(name, 'counter', help_text)
+                for (method, endpoint), stats in items:
+                    sample(name, (('method', method), ('endpoint', endpoint)),
+                           getattr(stats, attr))
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.summary(), indent=2,
+                                       sort_keys=True))
+
+    def write_prometheus(self, path):
+        _write_atomic(path, self.prometheus())
+
+    def export_at_exit(self, json_path=None, prometheus_path=None):
+        """Write the statistics to the given files when the process ends."""
+        def export():
+            try:
+                if json_path:
+                    self.write_json(json_path)
+                if prometheus_path:
+                    self.write_prometheus(prometheus_path)
+            except (IOError, OSError) as e:
+                LOG.warning('Can not export request metrics: %s', e)
+        atexit.register(export)
+
+
+def _label_value(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _write_atomic(path, data):
+    # The node exporter textfile collector must never see partial files.
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
@@ -16,8 +16,14 @@ import functools
 import json
 import logging
 
+from fuel_ext.cache import cached
+from fuel_ext.cache import invalidates
+from fuel_ext.cache import LRUCache
+from fuel_ext.deployment_graph import DeploymentGraph
+from fuel_ext.event_stream import EventStream
 from fuel_ext.http import HTTPClient
 from fuel_ext import default_settings
+from fuel_ext.json_stream import iter_json_array
 
 
 LOG = logging.getLogger(__name__)
@@ -31,17 +37,36 @@ def json_parse(func):
     return wrapped
 
 
+def json_iter(func):
+    """Like json_parse, but yield the items of a JSON list one by one."""
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        response = func(*args, **kwargs)
+        return iter_json_array(response)
+    return wrapped
+
+
 class NailgunClient(object):
     """NailgunClient"""  # TODO documentation
 
-    def __init__(self, master_ip, username, password, tenant_name):
-        url = "http://{0}:8000".format(master_ip)
+    def __init__(self, master_ip, username, password, tenant_name,
+                 cache_ttl=None, cache_size=256, port=8000, keystone_port=5000,
+                 **kwargs):
+        url = "http://{0}:{1}".format(master_ip, port)
         LOG.info('Initiate Nailgun client with url %s', url)
-        self.keystone_url = "http://{0}:5000/v2.0".format(master_ip)
+        self.keystone_url = "http://{0}:{1}/v2.0".format(master_ip,
+                                                         keystone_port)
         self._client = HTTPClient(url=url, keystone_url=self.keystone_url,
                                   credentials={'username': username,
                                                'password': password,
-                                               'tenant_name': tenant_name})
+                                               'tenant_name': tenant_name},
+                                  **kwargs)
+        # Cluster, release and network configuration reads can be cached
+        # for cache_ttl seconds; off by default, as a status or network
+        # configuration changed by others would go unseen that long.
+        self.cache = None
+        if cache_ttl is not None:
+            self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
         super(NailgunClient, self).__init__()
 
     @property
@@ -59,6 +84,7 @@ class NailgunClient(object):
     def list_cluster_nodes(self, cluster_id):
         return self.client.get("/api/nodes/?cluster_id={}".format(cluster_id))
 
+    @cached('network')
     @json_parse
     def get_networks(self, cluster_id):
         net_provider = self.get_cluster(cluster_id)['net_provider']
@@ -68,6 +94,7 @@ class NailgunClient(object):
             )
         )
 
+    @invalidates('network')
     @json_parse
     def update_networks(self, cluster_id, data):
         net_provider = self.get_cluster(cluster_id)['net_provider']
@@ -100,11 +127,12 @@ class NailgunClient(object):
             "/api/clusters/{}/vmware_attributes/".format(cluster_id)
         )
 
+    @invalidates('cluster', 'network')
     @json_parse
     def update_cluster_attributes(self, cluster_id, attrs):
         return self.client.put(
             "/api/clusters/{}/attributes/".format(cluster_id),
-            attrs
+            attrs, idempotent=True
         )
 
     @json_parse
@@ -114,6 +142,7 @@ class NailgunClient(object):
             attrs
         )
 
+    @cached('cluster')
     @json_parse
     def get_cluster(self, cluster_id):
         return self.client.get(
@@ -125,12 +154,17 @@ class NailgunClient(object):
         return self.client.get(
             "/api/nodes/")
 
+    @json_iter
+    def iter_nodes(self):
+        return self.client.get("/api/nodes/")
+
     @json_parse
     def get_node(self, node_id):
         return self.client.get(
             "/api/nodes/{}".format(node_id)
         )
 
+    @invalidates('cluster', 'network')
     @json_parse
     def update_cluster(self, cluster_id, data):
         return self.client.put(
@@ -138,6 +172,7 @@ class NailgunClient(object):
             data
         )
 
+    @invalidates('cluster', 'network')
     @json_parse
     def delete_cluster(self, cluster_id):
         return self.client.delete(
@@ -162,6 +197,7 @@ class NailgunClient(object):
             data
         )
 
+    @invalidates('cluster')
     @json_parse
     def deploy_cluster_changes(self, cluster_id):
         return self.client.put(
@@ -176,18 +212,26 @@ class NailgunClient(object):
     def get_tasks(self):
         return self.client.get("/api/tasks")
 
+    @json_iter
+    def iter_tasks(self):
+        return self.client.get("/api/tasks")
+
+    @cached('release')
     @json_parse
     def get_releases(self):
         return self.client.get("/api/releases/")
 
+    @cached('release')
     @json_parse
     def get_release(self, release_id):
         return self.client.get("/api/releases/{}".format(release_id))
 
+    @invalidates('release')
     @json_parse
     def put_release(self, release_id, data):
         return self.client.put("/api/releases/{}".format(release_id), data)
 
+    @cached('release')
     @json_parse
     def get_releases_details(self, release_id):
         return self.client.get("/api/releases/{}".format(release_id))
@@ -198,7 +242,8 @@ class NailgunClient(object):
 
     @json_parse
     def put_node_disks(self, node_id, data):
-        return self.client.put("/api/nodes/{}/disks".format(node_id), data)
+        return self.client.put("/api/nodes/{}/disks".format(node_id), data,
+                               idempotent=True)
 
     def get_release_id(self, release_name=default_settings.OPENSTACK_RELEASE):
         for release in self.get_releases():
@@ -212,7 +257,7 @@ class NailgunClient(object):
     @json_parse
     def put_node_interfaces(self, node_id, data):
         return self.client.put("/api/nodes/{}/interfaces".format(node_id),
-                               data)
+                               data, idempotent=True)
 
     @json_parse
     def list_clusters(self):
@@ -230,15 +275,20 @@ class NailgunClient(object):
         return self.client.get("/ostf/testsets/{}".format(cluster_id))
 
     @json_parse
-    def get_ostf_tests(self, cluster_id):
-        return self.client.get("/ostf/tests/{}".format(cluster_id))
+    def get_ostf_tests(self, cluster_id, use_cache=True):
+        # The runs of a cluster fail until the server was asked for its
+        # tests, so they are not in the default response cache TTLs; a
+        # read made for that passes use_cache=False all the same, for
+        # caches given other TTLs.
+        return self.client.get("/ostf/tests/{}".format(cluster_id),
+                               use_cache=use_cache)
 
     @json_parse
     def get_ostf_test_run(self, cluster_id):
         return self.client.get("/ostf/testruns/last/{}".format(cluster_id))
 
     @json_parse
-    def ostf_run_tests(self, cluster_id, test_sets_list):
+    def ostf_run_tests(self, cluster_id, test_sets_list, fetch_tests=True):
         LOG.info('Run OSTF tests at cluster #%s: %s',
                  cluster_id, test_sets_list)
         data = []
@@ -249,15 +299,21 @@ class NailgunClient(object):
                     'testset': test_set
                 }
             )
-        # get tests otherwise 500 error will be thrown
-        self.get_ostf_tests(cluster_id)
+        # get tests otherwise 500 error will be thrown, unless the caller
+        # already did (with use_cache=False); the server has to see it, so
+        # no cache
+        if fetch_tests:
+            self.get_ostf_tests(cluster_id, use_cache=False)
         return self.client.post("/ostf/testruns", data)
 
     @json_parse
-    def ostf_run_singe_test(self, cluster_id, test_sets_list, test_name):
-        # get tests otherwise 500 error will be thrown
-        self.get_ostf_tests(cluster_id)
-        LOG.info('Get tests finish with success')
+    def ostf_run_singe_test(self, cluster_id, test_sets_list, test_name,
+                            fetch_tests=True):
+        # get tests otherwise 500 error will be thrown; the server has to
+        # see it, so no cache
+        if fetch_tests:
+            self.get_ostf_tests(cluster_id, use_cache=False)
+            LOG.info('Get tests finish with success')
         data = []
         for test_set in test_sets_list:
             data.append(
@@ -269,6 +325,7 @@ class NailgunClient(object):
             )
         return self.client.post("/ostf/testruns", data)
 
+    @invalidates('network')
     @json_parse
     def update_network(self, cluster_id, networking_parameters=None,
                        networks=None):
@@ -290,8 +347,8 @@ class NailgunClient(object):
     def get_cluster_id(self, name):
         for cluster in self.list_clusters():
             if cluster["name"] == name:
-                LOG.info('cluster name is %s' % name)
-                LOG.info('cluster id is %s' % cluster["id"])
+                LOG.info('cluster name is %s', name)
+                LOG.info('cluster id is %s', cluster["id"])
                 return cluster["id"]
 
     def add_syslog_server(self, cluster_id, host, port):
@@ -315,6 +372,14 @@ class NailgunClient(object):
     def get_notifications(self):
         return self.client.get("/api/notifications")
 
+    @json_iter
+    def iter_notifications(self):
+        return self.client.get("/api/notifications")
+
+    def event_stream(self, cursor_file=None, **kwargs):
+        """Return an EventStream of new notifications and task changes."""
+        return EventStream(self, cursor_file, **kwargs)
+
     @json_parse
     def update_redhat_setup(self, data):
         return self.client.post("/api/redhat/setup", data=data)
@@ -335,6 +400,7 @@ class NailgunClient(object):
     def reset_environment(self, cluster_id):
         return self.do_stop_reset_actions(cluster_id, action="reset")
 
+    @invalidates('cluster')
     @json_parse
     def do_cluster_action(self, cluster_id, action="provision"):
         nailgun_nodes = self.list_cluster_nodes(cluster_id)
@@ -346,6 +412,7 @@ class NailgunClient(object):
                 ','.join(cluster_node_ids))
         )
 
+    @invalidates('cluster')
     @json_parse
     def do_stop_reset_actions(self, cluster_id, action="stop_deployment"):
         return self.client.put(
@@ -355,6 +422,7 @@ class NailgunClient(object):
     def get_api_version(self):
         return self.client.get("/api/version")
 
+    @invalidates('cluster')
     @json_parse
     def run_update(self, cluster_id):
         return self.client.put(
@@ -400,6 +468,18 @@ class NailgunClient(object):
         return self.client.get(
             '/api/releases/{}/deployment_tasks'.format(release_id))
 
+    def get_cluster_deployment_graph(self, cluster_id):
+        """Get the deployment tasks of a cluster as a DeploymentGraph.
+
+        Subgraphs for any start and end are then selected locally, with
+        no further requests.
+        """
+        return DeploymentGraph(self.get_cluster_deployment_tasks(cluster_id))
+
+    def get_release_deployment_graph(self, release_id):
+        """Get the deployment tasks of a release as a DeploymentGraph."""
+        return DeploymentGraph(self.get_release_deployment_tasks(release_id))
+
     @json_parse
     def get_end_deployment_tasks(self, cluster_id, end, start=None):
         """ Get list of all deployment tasks for cluster with end parameter.
@@ -418,14 +498,22 @@ class NailgunClient(object):
         return self.client.get(
             '/api/clusters/{}/orchestrator/deployment'.format(cluster_id))
 
+    @json_iter
+    def iter_deployment_info(self, cluster_id):
+        """Yield the orchestrator deployment info one node at a time."""
+        return self.client.get(
+            '/api/clusters/{}/orchestrator/deployment'.format(cluster_id))
+
     @json_parse
     def put_deployment_tasks_for_cluster(self, cluster_id, data, node_id):
         """ Put  task to be executed on the nodes from cluster.:
         Params:
         cluster_id : Cluster id,
         node_id: Node ids where task should be run, can be node_id=1,
-        or node_id =1,2,3,
-        data: tasks ids"""
+        or node_id =1,2,3, or a list of ids,
+        data: tasks ids, e.g. from DeploymentGraph.plan()"""
+        if isinstance(node_id, (list, tuple)):
+            node_id = ','.join(str(n) for n in node_id)
         return self.client.put(
             '/api/clusters/{0}/deploy_tasks?nodes={1}'.format(
                 cluster_id, node_id), data)
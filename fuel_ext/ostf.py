@@ -0,0 +1,226 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""OSTF test sets run on many clusters at once, with one report.
+
+    fuel-ostf --master-ip 10.20.0.2 --cluster 1 2 3 --testset sanity smoke \\
+        --json ostf.json --junit ostf.xml
+"""
+
+import argparse
+import collections
+import json
+import logging
+import sys
+import time
+from xml.etree import ElementTree
+
+from fuel_ext import default_settings
+from fuel_ext.nailgun_client import NailgunClient
+from fuel_ext import parallel
+
+
+LOG = logging.getLogger(__name__)
+
+FINISHED_RUN_STATUSES = ('finished', 'stopped')
+FAILED_TEST_STATUSES = ('failure', 'error', 'stopped', 'timeout')
+
+
+class OSTFRunner(object):
+    """Starts OSTF test sets on several clusters and waits for them all.
+
+    The test list of each cluster is fetched once, before its runs are
+    started. The last runs of the clusters still running are then polled
+    every `interval` seconds, `backoff` times less often up to
+    `max_interval` while no run finishes. Runs not finished after
+    `timeout` seconds are reported with a 'timeout' status.
+    """
+
+    def __init__(self, client, concurrency=8, interval=2, max_interval=15,
+                 backoff=1.5, timeout=None):
+        self.client = client
+        self.concurrency = concurrency
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def _start(self, cluster_id, test_sets):
+        # OSTF discovers the tests of a cluster when they are listed, runs
+        # of tests never listed fail.
+        self.client.get_ostf_tests(cluster_id, use_cache=False)
+        self.client.ostf_run_tests(cluster_id, test_sets, fetch_tests=False)
+
+    def _poll(self, cluster_id, test_sets):
+        try:
+            runs = dict((r['testset'], r)
+                        for r in self.client.get_ostf_test_run(cluster_id))
+        except Exception as e:
+            # Polled again next round, until the timeout.
+            LOG.warning('Polling OSTF runs of cluster %s failed: %s',
+                        cluster_id, e)
+            return None
+        return dict((test_set, runs.get(test_set)) for test_set in test_sets)
+
+    def run(self, test_sets_by_cluster):
+        """Run {cluster ID: [test set]} and return the report."""
+        started_at = time.time()
+        clusters = dict((cluster_id, {'test_sets': {}, 'error': None})
+                        for cluster_id in test_sets_by_cluster)
+        try:
+            parallel.map_keys(
+                lambda c: self._start(c, test_sets_by_cluster[c]),
+                test_sets_by_cluster, self.concurrency)
+        except parallel.ParallelError as e:
+            for cluster_id, error in e.errors.items():
+                clusters[cluster_id]['error'] = str(error)
+        pending = set(c for c in clusters if clusters[c]['error'] is None)
+
+        interval = self.interval
+        while pending:
+            time.sleep(interval)
+            results = parallel.map_keys(
+                lambda c: self._poll(c, test_sets_by_cluster[c]),
+                pending, self.concurrency)
+            finished = set()
+            for cluster_id, runs in results.items():
+                if runs is None:
+                    continue
+                clusters[cluster_id]['test_sets'] = runs
+                if all(run is not None and
+                       run['status'] in FINISHED_RUN_STATUSES
+                       for run in runs.values()):
+                    finished.add(cluster_id)
+            pending -= finished
+            if finished:
+                interval = self.interval
+            else:
+                interval = min(interval * self.backoff, self.max_interval)
+            if (pending and self.timeout is not None and
+                    time.time() - started_at > self.timeout):
+                for cluster_id in pending:
+                    clusters[cluster_id]['error'] = 'timeout'
+                break
+        return _report(clusters, started_at, pending)
+
+
+def _report(clusters, started_at, timed_out):
+    report = {'started_at': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                          time.localtime(started_at)),
+              'duration': round(time.time() - started_at, 3),
+              'clusters': {}}
+    totals = collections.Counter()
+    for cluster_id, cluster in sorted(clusters.items()):
+        test_sets = {}
+        for test_set, run in sorted(cluster['test_sets'].items()):
+            tests = []
+            for test in (run or {}).get('tests') or []:
+                status = test.get('status')
+                if cluster_id in timed_out and status not in (
+                        'success', 'failure', 'error', 'skipped',
+                        'disabled'):
+                    status = 'timeout'
+                totals[status] += 1
+                tests.append({'id': test.get('id'), 'name': test.get('name'),
+                              'status': status, 'taken': test.get('taken'),
+                              'message': test.get('message')})
+            test_sets[test_set] = {
+                'status': 'timeout' if cluster_id in timed_out
+                else (run or {}).get('status'),
+                'tests': tests}
+        report['clusters'][str(cluster_id)] = {'error': cluster['error'],
+                                               'test_sets': test_sets}
+    report['totals'] = dict(totals)
+    report['failed'] = bool(
+        any(c['error'] for c in clusters.values()) or
+        any(totals[s] for s in FAILED_TEST_STATUSES))
+    return report
+
+
+def write_json(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def write_junit(report, path):
+    """Write the report as JUnit XML, one test suite per cluster test set."""
+    suites = ElementTree.Element('testsuites', name='ostf',
+                                 time=str(report['duration']))
+    for cluster_id, cluster in sorted(report['clusters'].items()):
+        if cluster['error'] and not cluster['test_sets']:
+            suite = ElementTree.SubElement(
+                suites, 'testsuite', name='cluster-{0}'.format(cluster_id),
+                tests='1', failures='0', errors='1', skipped='0', time='0')
+            case = ElementTree.SubElement(suite, 'testcase', name='start',
+                                          classname='cluster-{0}'.format(
+                                              cluster_id))
+            ElementTree.SubElement(case, 'error', message=cluster['error'])
+            continue
+        for test_set, run in sorted(cluster['test_sets'].items()):
+            counts = collections.Counter(t['status'] for t in run['tests'])
+            suite = ElementTree.SubElement(
+                suites, 'testsuite',
+                name='cluster-{0}.{1}'.format(cluster_id, test_set),
+                tests=str(len(run['tests'])),
+                failures=str(counts['failure']),
+                errors=str(counts['error'] + counts['stopped'] +
+                           counts['timeout']),
+                skipped=str(counts['skipped'] + counts['disabled']),
+                time=str(sum(t['taken'] or 0 for t in run['tests'])))
+            for test in run['tests']:
+                classname, _, name = (test['id'] or '').rpartition('.')
+                case = ElementTree.SubElement(
+                    suite, 'testcase', classname=classname,
+                    name=test['name'] or name, time=str(test['taken'] or 0))
+                message = test['message'] or test['status'] or ''
+                if test['status'] == 'failure':
+                    ElementTree.SubElement(case, 'failure', message=message)
+                elif test['status'] in ('error', 'stopped', 'timeout'):
+                    ElementTree.SubElement(case, 'error', message=message)
+                elif test['status'] in ('skipped', 'disabled'):
+                    ElementTree.SubElement(case, 'skipped', message=message)
+    ElementTree.ElementTree(suites).write(path, encoding='utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='fuel-ostf')
+    parser.add_argument('--cluster', type=int, nargs='+', required=True)
+    parser.add_argument('--testset', nargs='+', required=True)
+    parser.add_argument('--master-ip', default='10.20.0.2')
+    for option in ('username', 'password', 'tenant_name'):
+        parser.add_argument(
+            '--' + option.replace('_', '-'),
+            default=default_settings.DEFAULT[option]['default'])
+    parser.add_argument('--timeout', type=float, default=3600)
+    parser.add_argument('--json', metavar='PATH')
+    parser.add_argument('--junit', metavar='PATH')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    client = NailgunClient(args.master_ip, args.username, args.password,
+                           args.tenant_name)
+    report = OSTFRunner(client, timeout=args.timeout).run(
+        dict((cluster_id, args.testset) for cluster_id in args.cluster))
+    if args.json:
+        write_json(report, args.json)
+    if args.junit:
+        write_junit(report, args.junit)
+    sys.stdout.write('{0}\n'.format(json.dumps(report['totals'],
+                                               sort_keys=True)))
+    if report['failed']:
+        sys.exit('OSTF failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+
+
+LOG = logging.getLogger(__name__)
+
+# Attributes the caller of map_keys() sets here are seen by `func` in the
+# worker threads too, e.g. to tell which job a log record belongs to.
+context = threading.local()
+
+
+class ParallelError(Exception):
+    """Raised when a call failed for one or more of the given keys."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(ParallelError, self).__init__(
+            '\n'.join('{0}: {1}'.format(key, err)
+                      for key, err in sorted(errors.items())))
+
+
+def map_keys(func, keys, concurrency=1):
+    """Call `func(key)` for every key and return a {key: result} dict.
+
+    With concurrency greater than one calls are spread over a thread pool
+    of that size. Every call is done even if some of them fail; the
+    failures are then raised together as a single ParallelError.
+    """
+    keys = list(keys)
+    results = {}
+    errors = {}
+    inherited = dict(vars(context))
+
+    def call(key):
+        vars(context).update(inherited)
+        try:
+            return key, func(key), None
+        except Exception as e:
+            LOG.exception('Call failed for %s', key)
+            return key, None, e
+
+    if concurrency > 1 and len(keys) > 1:
+        pool = ThreadPool(min(concurrency, len(keys)))
+        try:
+            outcomes = pool.map(call, keys)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        outcomes = [call(key) for key in keys]
+
+    for key, result, error in outcomes:
+        if error is not None:
+            errors[key] = error
+        else:
+            results[key] = result
+    if errors:
+        raise ParallelError(errors)
+    return results
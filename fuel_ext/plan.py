@@ -0,0 +1,89 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+
+class _Missing(object):
+
+    def __repr__(self):
+        return '<missing>'
+
+
+MISSING = _Missing()
+
+
+def _index(items):
+    """Index a list of dicts by their 'name' (or 'id') if it is unique."""
+    for key in ('name', 'id'):
+        if all(isinstance(item, dict) and key in item for item in items):
+            indexed = dict((item[key], item) for item in items)
+            if len(indexed) == len(items):
+                return indexed
+    return None
+
+
+def diff(current, desired, path=()):
+    """Return the (path, current, desired) leaves that differ.
+
+    Dicts are compared key by key. Lists of dicts which all have a unique
+    'name' (or 'id') are compared item by item regardless of their order,
+    other lists as a whole. Absent keys are reported as MISSING.
+    """
+    if current == desired:
+        return []
+    if isinstance(current, list) and isinstance(desired, list):
+        indexed_current = _index(current)
+        indexed_desired = _index(desired)
+        if indexed_current is not None and indexed_desired is not None:
+            current, desired = indexed_current, indexed_desired
+    if isinstance(current, dict) and isinstance(desired, dict):
+        changes = []
+        for key in sorted(set(current) | set(desired)):
+            changes.extend(diff(current.get(key, MISSING),
+                                desired.get(key, MISSING),
+                                path + (key,)))
+        return changes
+    return [(path, current, desired)]
+
+
+class Plan(object):
+    """Changes an environment build makes, grouped by section and target.
+
+    Each entry is (section, target, changes), changes being a list of
+    (path, current, desired) as returned by diff().
+    """
+
+    def __init__(self):
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def __nonzero__(self):
+        return bool(self.entries)
+
+    def add(self, section, target, changes):
+        with self._lock:
+            self.entries.append((section, target, changes))
+
+    def format(self):
+        if not self.entries:
+            return 'No changes.'
+        lines = []
+        for section, target, changes in self.entries:
+            lines.append('{0} {1}:'.format(section, target))
+            for path, current, desired in changes:
+                lines.append('  {0}: {1!r} -> {2!r}'.format(
+                    '.'.join(str(p) for p in path) or '.',
+                    current, desired))
+        return '\n'.join(lines)
@@ -0,0 +1,169 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import logging
+from multiprocessing.pool import ThreadPool
+import Queue
+import sys
+import time
+
+from fuel_ext import deployment_graph
+from fuel_ext import parallel
+
+
+LOG = logging.getLogger(__name__)
+
+
+class StepError(Exception):
+    """Raised when a step failed; the steps requiring it were not run.
+
+    `exc_info` is that of the failure, to re-raise it as it was.
+    """
+
+    def __init__(self, step, exc_info, timings):
+        self.step = step
+        self.exc_info = exc_info
+        self.timings = timings
+        super(StepError, self).__init__('Step {0} failed: {1}'.format(
+            step, str(exc_info[1]) or repr(exc_info[1])))
+
+
+class Timings(object):
+    """When each step of a run started and how long it took."""
+
+    def __init__(self, requires):
+        self.requires = requires
+        self.started = {}  # step: seconds since the start of the run
+        self.durations = {}
+
+    def total(self):
+        if not self.started:
+            return 0
+        return max(self.started[s] + self.durations[s]
+                   for s in self.durations)
+
+    def critical_path(self):
+        """Return the chain of steps whose durations add up the most.
+
+        No schedule can run the steps faster than this chain takes.
+        """
+        longest = {}
+        for step in sorted(self.durations, key=self.started.get):
+            before = [longest[r] for r in self.requires[step]
+                      if r in longest]
+            chain = max(before, key=lambda c: c[0]) if before else (0, [])
+            longest[step] = (chain[0] + self.durations[step],
+                             chain[1] + [step])
+        if not longest:
+            return []
+        return max(longest.values(), key=lambda c: c[0])[1]
+
+    def format(self):
+        critical = set(self.critical_path())
+        lines = []
+        for step in sorted(self.durations, key=self.started.get):
+            lines.append('{0} {1:<20} {2:7.2f}s {3:7.2f}s'.format(
+                '*' if step in critical else ' ', step,
+                self.started[step], self.durations[step]))
+        lines.append('  {0:<20} {1:7.2f}s (critical path {2:.2f}s)'.format(
+            'total', self.total(),
+            sum(self.durations[s] for s in critical)))
+        return '\n'.join(lines)
+
+
+class Steps(object):
+    """Named steps with declared dependencies, run as soon as possible.
+
+    A step is `func(results)`, `results` holding the return values of
+    the steps run before it by name. Steps are started in a thread pool
+    once every step they require is done, so a run takes about as long
+    as its critical path rather than the sum of the steps.
+    """
+
+    def __init__(self):
+        self.steps = collections.OrderedDict()
+
+    def add(self, name, func, requires=()):
+        self.steps[name] = (func, tuple(requires))
+
+    def order(self):
+        """Return the step names, every step after those it requires.
+
+        Raises CycleError if steps require each other.
+        """
+        graph = deployment_graph.DeploymentGraph(
+            {'id': name, 'requires': requires}
+            for name, (_, requires) in self.steps.iteritems())
+        if graph.missing:
+            raise KeyError('Unknown step(s) required: {0}'.format(
+                ', '.join(sorted(graph.missing))))
+        return graph.topological_order()
+
+    def run(self, concurrency=None):
+        """Run all the steps, return their results and Timings.
+
+        On the first failure no new step is started; those running are
+        waited for, then StepError is raised.
+        """
+        self.order()
+        requires = dict((name, requires)
+                        for name, (_, requires) in self.steps.iteritems())
+        timings = Timings(requires)
+        results = {}
+        waiting = dict((name, set(r)) for name, r in requires.iteritems())
+        done = Queue.Queue()
+        inherited = dict(vars(parallel.context))
+        run_started = time.time()
+
+        def call(name):
+            vars(parallel.context).update(inherited)
+            started = time.time()
+            try:
+                result, error = self.steps[name][0](results), None
+            except Exception:
+                result, error = None, sys.exc_info()
+            done.put((name, started, time.time(), result, error))
+
+        pool = ThreadPool(concurrency or len(self.steps) or 1)
+        failed = None
+        running = 0
+        try:
+            while True:
+                if failed is None:
+                    # Steps are started in the order they were added.
+                    for name in [n for n in self.steps
+                                 if n in waiting and not waiting[n]]:
+                        del waiting[name]
+                        pool.apply_async(call, (name,))
+                        running += 1
+                if not running:
+                    break
+                name, started, finished, result, error = done.get()
+                running -= 1
+                timings.started[name] = started - run_started
+                timings.durations[name] = finished - started
+                LOG.debug('Step %s done in %.2fs', name, finished - started)
+                if error is not None:
+                    failed = failed or (name, error)
+                    continue
+                results[name] = result
+                for other in waiting.values():
+                    other.discard(name)
+        finally:
+            pool.close()
+            pool.join()
+        if failed is not None:
+            raise StepError(failed[0], failed[1], timings)
+        return results, timings
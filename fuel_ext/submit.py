@@ -0,0 +1,92 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Submit fuel-env jobs to a running fuel-env-daemon.
+
+Takes the same arguments as fuel-env and prints the same output, the log
+of the job being streamed to stderr while it runs. Only the standard
+library is imported here so that submitting a job is cheap.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+
+DEFAULT_SOCKET = '/var/run/fuel_ext.sock'
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='fuel-env-submit')
+    parser.add_argument('settings', nargs='+',
+                        help='settings JSON file, or a directory of them')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='Unix socket fuel-env-daemon listens on')
+    parser.add_argument('--concurrency', type=int, default=1, metavar='N',
+                        help='number of nodes processed in parallel')
+    parser.add_argument('--parallel-envs', type=int, default=1, metavar='N',
+                        help='number of environments built in parallel')
+    parser.add_argument('--plan', action='store_true',
+                        help='only print the changes a build would make')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the steps a previous build recorded as '
+                             'done')
+    parser.add_argument('--timings', action='store_true',
+                        help='print how long each build step took')
+    return parser.parse_args(argv)
+
+
+def submit(path, job, log=sys.stderr):
+    """Send a job to the daemon, stream its log, return the final message.
+
+    The settings paths of the job are read by the daemon, they must be
+    absolute.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(job) + '\n')
+        replies = sock.makefile('r', 0)
+        for line in iter(replies.readline, ''):
+            message = json.loads(line)
+            if 'log' not in message:
+                return message
+            log.write(message['log'] + '\n')
+    finally:
+        sock.close()
+    raise socket.error('fuel-env-daemon closed the connection')
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    job = {'settings': [os.path.abspath(path) for path in args.settings],
+           'concurrency': args.concurrency,
+           'parallel_envs': args.parallel_envs,
+           'plan': args.plan,
+           'resume': args.resume,
+           'timings': args.timings}
+    try:
+        result = submit(args.socket, job)
+    except socket.error as e:
+        sys.exit('Can not submit to fuel-env-daemon at %s: %s' % (
+            args.socket, e))
+    sys.stdout.write(result['output'])
+    if result['error']:
+        sys.exit(result['error'])
+
+
+if __name__ == '__main__':
+    main()
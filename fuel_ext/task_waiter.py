@@ -0,0 +1,215 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+FINAL_STATUSES = ('ready', 'error')
+
+
+class TaskError(Exception):
+    """Raised for a task that finished with an error or disappeared."""
+
+    def __init__(self, task, message=None):
+        self.task = task
+        super(TaskError, self).__init__(
+            message or 'Task {0} ({1}) failed: {2}'.format(
+                task.get('id'), task.get('name'), task.get('message')))
+
+
+class TaskFuture(object):
+    """Completion handle of a single Nailgun task."""
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.task = None
+        self._error = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the task and return its final state.
+
+        Raises TaskError if the task failed.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError(
+                'Timed out waiting for task {0}'.format(self.task_id))
+        if self._error is not None:
+            raise self._error
+        return self.task
+
+    def add_done_callback(self, callback):
+        """Call `callback(future)` once the task is finished."""
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _finish(self, task, error=None):
+        with self._lock:
+            self.task = task
+            self._error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                LOG.exception('Callback for task %s failed', self.task_id)
+
+
+class TaskWaiter(object):
+    """Wait for any number of Nailgun tasks with one request per poll.
+
+    All watched tasks, whatever their cluster, are checked with a single
+    tasks request. The poll interval starts at `interval` and grows by
+    `backoff` up to `max_interval` while nothing changes; it drops back to
+    `interval` as soon as one of the tasks makes progress.
+
+        waiter = TaskWaiter(client)
+        future = waiter.watch(client.deploy_cluster_changes(cluster_id))
+        waiter.wait(timeout=3600)
+        future.result()
+    """
+
+    def __init__(self, client, interval=1, max_interval=30, backoff=1.5):
+        self.client = client
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self._futures = {}
+        self._states = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, task, callback=None):
+        """Start tracking a task given as a task dict or an ID."""
+        task_id = task['id'] if isinstance(task, dict) else task
+        with self._lock:
+            future = self._futures.get(task_id)
+            if future is None:
+                future = self._futures[task_id] = TaskFuture(task_id)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    @property
+    def pending(self):
+        with self._lock:
+            return [f for f in self._futures.values() if not f.done()]
+
+    def poll(self):
+        """Check all pending tasks once, return True if any of them moved."""
+        pending = dict((f.task_id, f) for f in self.pending)
+        if not pending:
+            return False
+        changed = False
+        seen = set()
+        for task in self.client.iter_tasks():
+            future = pending.get(task['id'])
+            if future is None:
+                continue
+            seen.add(task['id'])
+            state = (task.get('status'), task.get('progress'))
+            if self._states.get(task['id']) != state:
+                self._states[task['id']] = state
+                changed = True
+            if task.get('status') == 'error':
+                future._finish(task, TaskError(task))
+            elif task.get('status') in FINAL_STATUSES:
+                future._finish(task)
+        for task_id in set(pending) - seen:
+            changed = True
+            task = {'id': task_id}
+            future = pending[task_id]
+            future._finish(task, TaskError(
+                task, 'Task {0} disappeared'.format(task_id)))
+        for task_id, future in pending.items():
+            if future.done():
+                self._states.pop(task_id, None)
+                with self._lock:
+                    self._futures.pop(task_id, None)
+        return changed
+
+    def wait(self, tasks=None, timeout=None):
+        """Poll until the given tasks (default: all watched) are finished.
+
+        Returns the list of futures, in the order of `tasks`.
+        """
+        if tasks is None:
+            futures = self.pending
+        else:
+            futures = [self.watch(task) for task in tasks]
+        deadline = None if timeout is None else time.time() + timeout
+        interval = self.interval
+        while True:
+            if self._thread is None:
+                if self.poll():
+                    interval = self.interval
+                else:
+                    interval = min(interval * self.backoff,
+                                   self.max_interval)
+            # Otherwise the background thread does the polling.
+            if all(f.done() for f in futures):
+                break
+            sleep = interval
+            if deadline is not None:
+                left = deadline - time.time()
+                if left <= 0:
+                    raise RuntimeError('Timed out waiting for tasks')
+                sleep = min(sleep, left)
+            time.sleep(sleep)
+        return futures
+
+    def start(self):
+        """Poll in a background thread, completing futures as they end."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='task-waiter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        interval = self.interval
+        while not self._stop.is_set():
+            try:
+                moved = self.poll()
+            except Exception:
+                LOG.exception('Failed to poll tasks')
+                moved = False
+            if moved:
+                interval = self.interval
+            else:
+                interval = min(interval * self.backoff, self.max_interval)
+            self._stop.wait(interval)
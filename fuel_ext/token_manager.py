@@ -0,0 +1,178 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import calendar
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from keystoneclient.v2_0 import Client as keystoneclient
+from keystoneclient import exceptions
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.expanduser('~/.cache/fuel_ext/tokens')
+
+
+class TokenManager(object):
+    """Keystone token shared by all the threads of an HTTPClient.
+
+    The token is renewed in the background once it is within
+    `refresh_margin` seconds of its expiry, and in the foreground only if
+    it is really expired (less than `expiry_margin` seconds left). Renewals
+    are single-flight: threads needing a new token at the same time wait
+    for one keystone call. Tokens are also saved to a file readable only
+    by the user in `directory`, so that short-lived processes reuse them;
+    pass directory=None not to.
+
+    After keystone refused the credentials no token is asked for during
+    `failure_backoff` seconds, doubled by every failure in a row up to
+    `max_failure_backoff`; meanwhile `token` is None without a call.
+    """
+
+    def __init__(self, keystone_url, credentials, directory=DEFAULT_DIRECTORY,
+                 refresh_margin=300, expiry_margin=30, failure_backoff=1,
+                 max_failure_backoff=60):
+        self.keystone_url = keystone_url
+        self.creds = credentials
+        self.directory = directory
+        self.refresh_margin = refresh_margin
+        self.expiry_margin = expiry_margin
+        self.failure_backoff = failure_backoff
+        self.max_failure_backoff = max_failure_backoff
+        self.keystone = None
+        self.stats = collections.Counter()
+        self._token = None
+        self._expires_at = 0
+        self._refreshing = False
+        self._failures = 0
+        self._failed_until = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            self._load()
+
+    @property
+    def token(self):
+        """Return a valid token, None if keystone can not be reached."""
+        token, expires_at = self._token, self._expires_at
+        left = expires_at - time.time()
+        if token is not None and left > self.expiry_margin:
+            if left < self.refresh_margin and not self._refreshing:
+                self._refresh_in_background(token)
+            return token
+        return self.refresh(stale=token)
+
+    def invalidate(self, token):
+        """Forget a token the server rejected, unless already renewed."""
+        with self._lock:
+            if self._token == token:
+                self._token = None
+
+    def refresh(self, stale=None):
+        """Authenticate, unless the `stale` token was renewed meanwhile."""
+        with self._lock:
+            if self._token is not None and self._token != stale:
+                return self._token
+            if time.time() < self._failed_until:
+                self.stats['backed off'] += 1
+                return None
+            self._authenticate()
+            return self._token
+
+    def _refresh_in_background(self, token):
+        with self._lock:
+            if self._refreshing or self._token != token:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.refresh(stale=token)
+            except Exception:
+                LOG.exception('Background token refresh failed')
+            finally:
+                self._refreshing = False
+
+        thread = threading.Thread(target=refresh, name='token-refresh')
+        thread.daemon = True
+        thread.start()
+
+    def _authenticate(self):
+        self.stats['authenticated'] += 1
+        try:
+            LOG.info('Initialize keystoneclient with url %s',
+                     self.keystone_url)
+            self.keystone = keystoneclient(
+                auth_url=self.keystone_url, **self.creds)
+            # it depends on keystone version, some versions doing auth
+            # explicitly some dont, but we are making it explicitly always
+            self.keystone.authenticate()
+            LOG.debug('Authorization token is successfully updated')
+        # Unauthorized is what wrong credentials get, they are not retried
+        # any sooner than an unreachable keystone.
+        except (exceptions.AuthorizationFailure,
+                exceptions.Unauthorized) as e:
+            self._failures += 1
+            backoff = min(self.max_failure_backoff,
+                          self.failure_backoff * 2 ** (self._failures - 1))
+            self._failed_until = time.time() + backoff
+            LOG.warning(
+                'Cant establish connection to keystone with url %s (%s), '
+                'not retrying for %ss', self.keystone_url, e, backoff)
+            self._token = None
+            return
+        self._failures = 0
+        self._failed_until = 0
+        auth_ref = self.keystone.auth_ref
+        self._token = auth_ref.auth_token
+        self._expires_at = calendar.timegm(auth_ref.expires.utctimetuple())
+        if self.directory is not None:
+            self._save()
+
+    def _path(self):
+        key = json.dumps([self.keystone_url, self.creds], sort_keys=True)
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + '.json')
+
+    def _load(self):
+        try:
+            with open(self._path()) as f:
+                saved = json.load(f)
+            token, expires_at = saved['token'], saved['expires_at']
+        except (IOError, ValueError, KeyError, TypeError):
+            return
+        if expires_at - time.time() > self.expiry_margin:
+            self.stats['loaded'] += 1
+            self._token, self._expires_at = token, expires_at
+
+    def _save(self):
+        path = self._path()
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, int('0700', 8))
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         int('0600', 8))
+            os.fchmod(fd, int('0600', 8))
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'token': self._token,
+                           'expires_at': self._expires_at}, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            LOG.warning('Can not save token to %s: %s', self.directory, e)
@@ -0,0 +1,308 @@
+#    Copyright 2015 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Validation of settings, before anything is written to the master.
+
+validate_settings() checks a settings document on its own: its structure
+against SETTINGS_SCHEMA, compiled once into nested check functions, and
+the references inside it (duplicate MACs, network names). Once the
+inventory is fetched, validate_inventory() checks the settings against it
+(MACs, interface names, disk layouts). Both go through the nodes once using
+dicts, and raise a ValidationError with every error found rather than
+stopping at the first.
+"""
+
+from fuel_ext import disk_layout
+from fuel_ext import interface_layout
+
+# Networks assigned to node interfaces by the settings, all mandatory.
+# fuelweb_admin is assigned to the admin interface automatically.
+NETWORKS = ('private', 'public', 'storage', 'management')
+
+STRING = basestring
+INTEGER = (int, long)
+OPTIONAL_INTEGER = (int, long, type(None))
+# MB, "N%" or "rest", see disk_layout.
+SIZE = (int, long, basestring)
+
+
+class Optional(object):
+    """Schema of a dict value which may be absent."""
+
+    def __init__(self, spec):
+        self.spec = spec
+
+
+class MapOf(object):
+    """Schema of a dict with any string keys, its values matching spec."""
+
+    def __init__(self, spec):
+        self.spec = spec
+
+
+SETTINGS_SCHEMA = {
+    'env_name': STRING,
+    'master_ip': STRING,
+    'username': STRING,
+    'password': STRING,
+    'tenant_name': STRING,
+    # suite and section are required of deb repos, see _check_repos().
+    'repos': [{'name': STRING, 'type': STRING, 'uri': STRING,
+               'suite': Optional(STRING), 'section': Optional(STRING),
+               'priority': Optional(OPTIONAL_INTEGER)}],
+    'networks': {
+        'public_network': {'cidr': Optional(STRING),
+                           'gateway': Optional(STRING),
+                           'ip_ranges': Optional([[STRING]])},
+        'floating_ranges': [[STRING]],
+    },
+    'nodes': [{
+        'mac': STRING,
+        'name': Optional(STRING),
+        'roles': [STRING],
+        'interfaces': Optional(MapOf([STRING])),
+        'disks': Optional(MapOf(MapOf(SIZE))),
+    }],
+    'disk_layouts': MapOf(MapOf(MapOf(SIZE))),
+    'interface_templates': MapOf(MapOf([STRING])),
+    'admin_interface': STRING,
+}
+
+
+class ValidationError(Exception):
+    """Raised with every error found in a settings document."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(ValidationError, self).__init__(
+            '{0} error(s) in settings:\n{1}'.format(
+                len(errors), '\n'.join('  ' + e for e in errors)))
+
+
+def format_path(path):
+    text = ''
+    for part in path:
+        if isinstance(part, int):
+            text += '[{0}]'.format(part)
+        else:
+            text += '.{0}'.format(part) if text else part
+    return text or '.'
+
+
+def compile_schema(spec):
+    """Turn a schema into a check(value, path, errors) function.
+
+    A schema is a dict of schemas (its keys required unless Optional,
+    other keys allowed), a one-item list of the items schema, a MapOf, or
+    a type or tuple of types.
+    """
+    if isinstance(spec, dict):
+        fields = [(key, isinstance(field, Optional),
+                   compile_schema(field.spec if isinstance(field, Optional)
+                                  else field))
+                  for key, field in sorted(spec.items())]
+
+        def check_dict(value, path, errors):
+            if not isinstance(value, dict):
+                errors.append((path, 'must be an object'))
+                return
+            for key, optional, check in fields:
+                if key in value:
+                    check(value[key], path + (key,), errors)
+                elif not optional:
+                    errors.append((path + (key,), 'is missing'))
+        return check_dict
+
+    if isinstance(spec, list):
+        check_item = compile_schema(spec[0])
+
+        def check_list(value, path, errors):
+            if not isinstance(value, list):
+                errors.append((path, 'must be a list'))
+                return
+            for index, item in enumerate(value):
+                check_item(item, path + (index,), errors)
+        return check_list
+
+    if isinstance(spec, MapOf):
+        check_value = compile_schema(spec.spec)
+
+        def check_map(value, path, errors):
+            if not isinstance(value, dict):
+                errors.append((path, 'must be an object'))
+                return
+            for key, item in value.iteritems():
+                check_value(item, path + (key,), errors)
+        return check_map
+
+    types = spec if isinstance(spec, tuple) else (spec,)
+    name = {STRING: 'a string', INTEGER: 'an integer',
+            OPTIONAL_INTEGER: 'an integer or null', SIZE: 'a size'}[spec]
+
+    def check_type(value, path, errors):
+        # bool is an int, but never a valid size or priority.
+        if not isinstance(value, types) or isinstance(value, bool):
+            errors.append((path, 'must be {0}, not {1!r}'.format(
+                name, value)))
+    return check_type
+
+
+_check_settings = compile_schema(SETTINGS_SCHEMA)
+
+
+def _nodes(settings):
+    nodes = settings.get('nodes')
+    if not isinstance(nodes, list):
+        return []
+    return [(index, node) for index, node in enumerate(nodes)
+            if isinstance(node, dict) and isinstance(node.get('mac'), STRING)]
+
+
+def _raise(errors):
+    if errors:
+        raise ValidationError(['{0}: {1}'.format(format_path(path), message)
+                               for path, message in errors])
+
+
+def _check_layout(layout, path, errors):
+    if not isinstance(layout, dict):
+        return
+    for disk, volumes in sorted(layout.items()):
+        if not isinstance(volumes, dict):
+            continue
+        kinds = []
+        for volume, size in sorted(volumes.items()):
+            try:
+                kinds.append(disk_layout.parse_size(size))
+            except ValueError as e:
+                errors.append((path + (disk, volume), str(e)))
+        if [kind for kind, _ in kinds].count(disk_layout.REST) > 1:
+            errors.append((path + (disk,), 'only one volume can take the '
+                           'rest of the disk'))
+        percent = sum(value for kind, value in kinds if kind == 'percent')
+        if percent > 100:
+            errors.append((path + (disk,), 'volumes take {0}% of the '
+                           'disk'.format(percent)))
+
+
+def _check_repos(repos, errors):
+    if not isinstance(repos, list):
+        return
+    for index, repo in enumerate(repos):
+        if not isinstance(repo, dict) or repo.get('type') != 'deb':
+            continue
+        for key in ('suite', 'section'):
+            if key not in repo:
+                errors.append((('repos', index, key),
+                               'is missing, deb repos need it'))
+
+
+def _check_interfaces(interfaces, path, errors):
+    if not isinstance(interfaces, dict):
+        return
+    assigned = {}
+    for iface, networks in sorted(interfaces.items()):
+        if not isinstance(networks, list):
+            continue
+        for network in networks:
+            if network not in NETWORKS:
+                errors.append((path + (iface,),
+                               'unknown network {0!r}, expected one of '
+                               '{1}'.format(network, ', '.join(NETWORKS))))
+            elif network in assigned:
+                errors.append((path + (iface,),
+                               'network {0} is assigned to {1} too'
+                               .format(network, assigned[network])))
+            else:
+                assigned[network] = iface
+    missing = [n for n in NETWORKS if n not in assigned]
+    if missing:
+        errors.append((path, 'mandatory network(s) {0} not assigned'
+                       .format(', '.join(missing))))
+
+
+def validate_settings(settings):
+    """Check a settings document, defaults included, on its own."""
+    errors = []
+    _check_settings(settings, (), errors)
+    _check_repos(settings.get('repos'), errors)
+    if isinstance(settings.get('disk_layouts'), dict):
+        for role, layout in sorted(settings['disk_layouts'].items()):
+            _check_layout(layout, ('disk_layouts', role), errors)
+    if isinstance(settings.get('interface_templates'), dict):
+        for role, layout in sorted(settings['interface_templates'].items()):
+            _check_interfaces(layout, ('interface_templates', role), errors)
+    macs = {}
+    for index, node in _nodes(settings):
+        path = ('nodes', index)
+        _check_layout(node.get('disks'), path + ('disks',), errors)
+        mac = node['mac'].lower()
+        if mac in macs:
+            errors.append((path + ('mac',), 'MAC {0} is used by {1} too'
+                           .format(node['mac'], format_path(macs[mac]))))
+        else:
+            macs[mac] = path
+        _check_interfaces(node.get('interfaces'), path + ('interfaces',),
+                          errors)
+    _raise(errors)
+
+
+def _by_mac(items):
+    if items is None:
+        return None
+    return dict((mac.lower(), item) for mac, item in items.iteritems())
+
+
+def validate_inventory(settings, nodes, interfaces=None, disks=None):
+    """Check valid settings against the inventory of the master.
+
+    `nodes` are the nodes of the master by MAC, `interfaces` and `disks`
+    those of the nodes from the settings, also by MAC, if fetched. MACs
+    are compared whatever their case.
+    """
+    errors = []
+    nodes = _by_mac(nodes)
+    interfaces = _by_mac(interfaces)
+    disks = _by_mac(disks)
+    for index, node in _nodes(settings):
+        path = ('nodes', index)
+        mac = node['mac'].lower()
+        if mac not in nodes:
+            errors.append((path + ('mac',), 'no node with MAC {0} in the '
+                           'inventory'.format(node['mac'])))
+            continue
+        if interfaces is not None and mac in interfaces:
+            names = set(i['name'] for i in interfaces[mac])
+            layout = interface_layout.node_layout(
+                node, settings.get('interface_templates') or {})
+            for iface in sorted(layout or {}):
+                if iface not in names:
+                    errors.append((path + ('interfaces', iface),
+                                   'node {0} has no such interface'
+                                   .format(node['mac'])))
+        if disks is not None and mac in disks:
+            sizes = dict((d['name'], d['size']) for d in disks[mac])
+            layout = disk_layout.node_layout(
+                node, settings.get('disk_layouts') or {})
+            for disk, volumes in sorted((layout or {}).items()):
+                if disk not in sizes:
+                    errors.append((path + ('disks', disk),
+                                   'node {0} has no such disk'.format(
+                                       node['mac'])))
+                    continue
+                try:
+                    disk_layout.resolve(volumes, sizes[disk])
+                except disk_layout.LayoutError as e:
+                    errors.append((path + ('disks', disk), str(e)))
+    _raise(errors)